@@ -0,0 +1,438 @@
+import json
+import os
+import re
+from concurrent.futures import as_completed
+
+from openai import OpenAI
+
+from chunking import estimate_tokens, split_pages_into_chunks, truncate_to_tokens
+from llm_json import IncrementalJSONParser, conforms, parse_model_json
+from prompts import (ANALYSIS_TEMPLATE, CONTINUATION_TEMPLATE, CORE_TEMPLATE, DELTA_TEMPLATE, EXAMPLE_STORYTELLING_TEXT,
+                     FACT_CHECK_TEMPLATE, GROUNDED_ANALYSIS_TEMPLATE, GROUNDED_CONTINUATION_TEMPLATE,
+                     GROUNDED_CORE_TEMPLATE, GROUNDED_DELTA_TEMPLATE, SECTION_TEMPLATE_VERSION, SECTION_TEMPLATES,
+                     SUMMARY_TEMPLATE)
+from resilient_client import ResilientClient, TokenBucket
+from result_cache import make_key
+from vision import image_content_part
+
+
+# --- Обращения к моделям ---
+# Модуль не зависит от Streamlit, поэтому функции можно вызывать из рабочих
+# потоков: ошибки API пробрасываются вызывающему коду, а не выводятся через st.error.
+# Тексты промптов — в prompts.py.
+
+NEBIUS_BASE_URL = "https://api.studio.nebius.ai/v1/"
+
+# Общий на процесс лимит запросов к провайдеру (token bucket)
+REQUESTS_PER_SECOND = 5.0
+HEDGE_SLOW_REQUESTS = False  # Дублировать запросы дольше p95: быстрее хвост, но дороже
+
+def make_client(api_key: str = None, base_url: str = NEBIUS_BASE_URL, requests_per_second: float = REQUESTS_PER_SECOND,
+                hedge: bool = HEDGE_SLOW_REQUESTS):
+    # Вне Streamlit ключ берётся из переменной окружения DEEPSEEK_API_KEY.
+    # Повторы делает ResilientClient, поэтому встроенные повторы OpenAI отключены
+    client = OpenAI(api_key=api_key or os.environ["DEEPSEEK_API_KEY"], base_url=base_url, max_retries=0)
+    return ResilientClient(client, rate_limiter=TokenBucket(requests_per_second), hedge=hedge)
+
+ANALYSIS_MODEL = "deepseek-ai/DeepSeek-R1"
+CAPTION_MODEL = "google/gemma-3-27b-it"
+# Версия шаблона входит в ключ кэша: после правки промпта старые записи не совпадут
+PROMPT_VERSION = ANALYSIS_TEMPLATE.key
+GROUNDED_PROMPT_VERSION = GROUNDED_ANALYSIS_TEMPLATE.key
+
+_CAPTION_LINE = re.compile(r"^\s*(?:\**Изображение\s*)?#?\s*(\d+)\s*[:.)\-—]\s*(.+)$")
+
+CAPTION_PROMPT_VERSION = "1"
+
+def caption_images(client, images: list) -> list:
+    # Несколько изображений уходят одним мультимодальным запросом, каждое —
+    # отдельной частью image_url, предварительно уменьшенное (см. vision.py).
+    # Возвращает описания в порядке images; None — описание получить не удалось
+    indices = list(range(1, len(images) + 1))
+    content = [{"type": "text", "text": (
+        "Кратко опишите, что изображено на каждом изображении (1-2 предложения). "
+        "Ответ — по одной строке на изображение в формате «#N: описание»."
+    )}]
+    prepared = []
+    for idx, img_data in zip(indices, images):
+        try:
+            part = image_content_part(img_data)
+        except Exception:
+            continue  # Битое или неподдерживаемое изображение пропускаем
+        content.append({"type": "text", "text": f"Изображение #{idx}:"})
+        content.append(part)
+        prepared.append(idx)
+    if not prepared:
+        return [None] * len(images)
+
+    try:
+        response = client.chat.completions.create(
+            model=CAPTION_MODEL,  # Используем указанную модель
+            max_tokens=150 * len(prepared),
+            temperature=0.3,
+            messages=[{"role": "user", "content": content}]
+        )
+        answer = response.choices[0].message.content.strip()
+    except Exception:
+        return [None] * len(images)
+
+    captions = {}
+    for line in answer.splitlines():
+        match = _CAPTION_LINE.match(line)
+        if match and int(match.group(1)) in prepared:
+            captions[int(match.group(1))] = match.group(2).strip()
+    if not captions and len(prepared) == 1:
+        captions[prepared[0]] = answer
+    return [captions.get(idx) for idx in indices]
+
+ANALYSIS_SECTIONS = ["strengths", "weaknesses", "fact_check", "storytelling_script", "tricky_questions"]
+TONES = ["Вдохновляющий", "Формальный", "Научно-популярный"]
+# От тона зависит только сценарий выступления
+TONE_INDEPENDENT_SECTIONS = [key for key in ANALYSIS_SECTIONS if key != "storytelling_script"]
+
+def without_fact_check(sections: list, grounded: bool) -> list:
+    # grounded — проверка фактов идёт отдельным запросом по слайдам (get_grounded_fact_check)
+    return [key for key in sections if key != "fact_check"] if grounded else sections
+
+# Бюджет на текст проекта в промпте анализа. Длинные документы не обрезаются,
+# а сжимаются map-reduce суммаризацией (см. condense_project_text)
+ANALYSIS_INPUT_TOKENS = 8000
+CHUNK_TOKENS = 3000
+SUMMARY_MODEL = "deepseek-ai/DeepSeek-V3"
+SUMMARY_MAX_TOKENS = 700
+SUMMARY_PROMPT_VERSION = SUMMARY_TEMPLATE.key
+MAX_REDUCE_ROUNDS = 3
+
+def truncate_project_text(project_text: str) -> str:
+    # Страховка на случай, если даже после сжатия текст не уложился в бюджет
+    return truncate_to_tokens(project_text, ANALYSIS_INPUT_TOKENS,
+                              "\n... (текст усечен для ускорения обработки)")
+
+def summarize_chunk(client, chunk: str, idx: int, total: int) -> str:
+    response = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=SUMMARY_TEMPLATE.messages(idx=idx, total=total, chunk=chunk),
+        temperature=0.2,
+        max_tokens=SUMMARY_MAX_TOKENS
+    )
+    return response.choices[0].message.content.strip()
+
+def condense_project_text(client, executor, project_text: str, cache=None) -> str:
+    # Map: фрагменты суммаризируются параллельно. Reduce: сводки склеиваются
+    # и при необходимости сжимаются ещё раз, пока не уложатся в бюджет
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if estimate_tokens(project_text) <= ANALYSIS_INPUT_TOKENS:
+            break
+        chunks = split_pages_into_chunks(project_text, CHUNK_TOKENS)
+        futures = [executor.submit(_cached_summary, client, cache, chunk, idx, len(chunks))
+                   for idx, chunk in enumerate(chunks, start=1)]
+        summaries = [future.result() for future in futures]
+        project_text = "\n\n".join(
+            f"[Часть {idx}/{len(chunks)}]\n{summary}" for idx, summary in enumerate(summaries, start=1)
+        )
+    return project_text
+
+def _cached_summary(client, cache, chunk: str, idx: int, total: int) -> str:
+    # Сводка зависит только от текста фрагмента, поэтому повторная загрузка
+    # того же документа не суммаризирует его заново
+    key = make_key("summary", " ".join(chunk.split()), SUMMARY_MODEL, SUMMARY_PROMPT_VERSION)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    summary = summarize_chunk(client, chunk, idx, total)
+    if cache is not None:
+        cache.set(key, summary)
+    return summary
+
+def build_analysis_messages(project_text: str, tone: str, grounded: bool = False) -> list:
+    template = GROUNDED_ANALYSIS_TEMPLATE if grounded else ANALYSIS_TEMPLATE
+    return template.messages(project_text=truncate_project_text(project_text), tone=tone)
+
+def _create_analysis(client, messages: list, **kwargs):
+    return client.chat.completions.create(
+        model=ANALYSIS_MODEL,  # Используем указанную модель
+        messages=messages,
+        temperature=0.5,
+        top_p=0.8,
+        max_tokens=with_reasoning(2000),  # Все разделы одним ответом плюс рассуждение R1
+        response_format={"type": "json_object"},
+        **kwargs
+    )
+
+def get_analysis_from_deepseek(client, project_text: str, tone: str, grounded: bool = False):
+    if not client:
+        return None
+    response = _create_analysis(client, build_analysis_messages(project_text, tone, grounded))
+    try:
+        data = parse_model_json(response.choices[0].message.content)
+    except ValueError:
+        data = {}
+    # Оборванные или некорректные разделы дозапрашиваются отдельно, а не весь анализ
+    return complete_analysis(client, data, project_text, tone, grounded=grounded)
+
+def stream_analysis_from_deepseek(client, project_text: str, tone: str, on_section, grounded: bool = False):
+    # Тот же запрос, что и в get_analysis_from_deepseek, но с stream=True:
+    # on_section(key, value) вызывается, как только раздел JSON пришёл целиком
+    if not client:
+        return None
+    parser = IncrementalJSONParser()
+    chunks = []
+    for chunk in _create_analysis(client, build_analysis_messages(project_text, tone, grounded), stream=True):
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        chunks.append(delta)
+        for key, value in parser.feed(delta):
+            on_section(key, value)
+    data = dict(parser.sections)
+    try:
+        data.update(parse_model_json("".join(chunks)))
+    except ValueError:
+        pass  # Обойдёмся разделами, которые парсер успел собрать
+    return complete_analysis(client, data, project_text, tone, on_section, grounded=grounded)
+
+# --- Анализ по разделам: отдельный параллельный запрос на каждый раздел ---
+SECTION_PROMPT_VERSION = f"sections-{SECTION_TEMPLATE_VERSION}"
+
+# DeepSeek-R1 сначала рассуждает в <think>…</think>, и эти токены входят в
+# max_tokens: без запаса ответ обрывается ещё внутри рассуждения, и раздел
+# теряется. Бюджеты ниже — только на сам JSON, запас добавляет with_reasoning
+REASONING_TOKENS = 2000
+
+def with_reasoning(output_tokens: int) -> int:
+    return output_tokens + REASONING_TOKENS
+
+# Сценарий просим «схожим по размеру» с примером: бюджет — от длины примера,
+# с запасом на JSON-обёртку и погрешность оценки токенов
+STORY_TOKENS = int(estimate_tokens(EXAMPLE_STORYTELLING_TEXT) * 1.5)
+
+# "shape" — ожидаемая структура раздела для проверки ответа (см. llm_json.conforms),
+# "max_tokens" — бюджет ответа без рассуждения
+SECTION_SPECS = {
+    "strengths": {
+        "shape": [str],
+        "max_tokens": 600,
+    },
+    "weaknesses": {
+        "shape": [str],
+        "max_tokens": 800,
+    },
+    "fact_check": {
+        "shape": [{"claim": str, "verdict": str, "explanation": str}],
+        "max_tokens": 1000,
+    },
+    "storytelling_script": {
+        "shape": {"introduction": str, "main_part": str, "conclusion": str},
+        "max_tokens": STORY_TOKENS,
+    },
+    "tricky_questions": {
+        "shape": [str],
+        "max_tokens": 600,
+    },
+}
+
+def build_section_messages(key: str, project_text: str, tone: str) -> list:
+    return SECTION_TEMPLATES[key].messages(project_text=truncate_project_text(project_text), tone=tone)
+
+def get_section_from_deepseek(client, key: str, project_text: str, tone: str, max_tokens: int = None):
+    # max_tokens — бюджет самого ответа, рассуждение модели добавляется сверху
+    response = client.chat.completions.create(
+        model=ANALYSIS_MODEL,
+        messages=build_section_messages(key, project_text, tone),
+        temperature=0.5,
+        top_p=0.8,
+        max_tokens=with_reasoning(max_tokens or SECTION_SPECS[key]["max_tokens"]),
+        response_format={"type": "json_object"}
+    )
+    value = _unwrap_section(key, parse_model_json(response.choices[0].message.content))
+    if not conforms(value, SECTION_SPECS[key]["shape"]):
+        raise ValueError("модель вернула неполный раздел")
+    return value
+
+def _unwrap_section(key: str, data: dict):
+    if key in data:
+        return data[key]
+    # Модель иногда опускает обёртку или называет поле иначе
+    if len(data) == 1:
+        return next(iter(data.values()))
+    return data
+
+# --- Дозапрос недостающих разделов ---
+def build_continuation_messages(keys: list, project_text: str, tone: str, grounded: bool = False) -> list:
+    template = GROUNDED_CONTINUATION_TEMPLATE if grounded else CONTINUATION_TEMPLATE
+    return template.messages(project_text=truncate_project_text(project_text), tone=tone,
+                             fields=", ".join(f'"{key}"' for key in keys))
+
+def build_core_messages(keys: list, project_text: str, grounded: bool = False) -> list:
+    template = GROUNDED_CORE_TEMPLATE if grounded else CORE_TEMPLATE
+    return template.messages(project_text=truncate_project_text(project_text),
+                             fields=", ".join(f'"{key}"' for key in keys))
+
+def complete_analysis(client, data: dict, project_text: str, tone: str, on_section=None,
+                      sections: list = ANALYSIS_SECTIONS, grounded: bool = False):
+    # Оставляет разделы, прошедшие проверку структуры, и одним небольшим запросом
+    # дозапрашивает остальные. Что не удалось и так — попадает в "section_errors"
+    sections = without_fact_check(sections, grounded)
+    result = {key: data[key] for key in sections if conforms(data.get(key), SECTION_SPECS[key]["shape"])}
+    missing = [key for key in sections if key not in result]
+    if not missing:
+        return result
+    if "storytelling_script" in missing:
+        messages = build_continuation_messages(missing, project_text, tone, grounded)
+    else:
+        messages = build_core_messages(missing, project_text, grounded)
+    error = "модель вернула неполный раздел"
+    try:
+        response = client.chat.completions.create(
+            model=ANALYSIS_MODEL,
+            messages=messages,
+            temperature=0.5,
+            top_p=0.8,
+            max_tokens=with_reasoning(sum(SECTION_SPECS[key]["max_tokens"] for key in missing)),
+            response_format={"type": "json_object"}
+        )
+        extra = parse_model_json(response.choices[0].message.content)
+        if len(missing) == 1:
+            extra = {missing[0]: _unwrap_section(missing[0], extra)}
+    except Exception as e:
+        extra = {}
+        error = str(e)
+    errors = {}
+    for key in missing:
+        if conforms(extra.get(key), SECTION_SPECS[key]["shape"]):
+            result[key] = extra[key]
+            if on_section:
+                on_section(key, result[key])
+        else:
+            errors[key] = error
+    if not result:
+        raise RuntimeError(f"Не удалось получить анализ: {error}")
+    if errors:
+        result["section_errors"] = errors
+    return result
+
+# --- Все тона сразу: общие разделы один раз, сценарий — на каждый тон ---
+CORE_PROMPT_VERSION = CORE_TEMPLATE.key
+GROUNDED_CORE_PROMPT_VERSION = GROUNDED_CORE_TEMPLATE.key
+STORY_PROMPT_VERSION = f"{SECTION_TEMPLATES['storytelling_script'].key}-{STORY_TOKENS}"
+
+def get_core_analysis(client, project_text: str, on_section=None, grounded: bool = False):
+    # Разделы без сценария одним запросом; недостающие дозапрашиваются
+    if not client:
+        return None
+    sections = without_fact_check(TONE_INDEPENDENT_SECTIONS, grounded)
+    response = client.chat.completions.create(
+        model=ANALYSIS_MODEL,
+        messages=build_core_messages(sections, project_text, grounded),
+        temperature=0.5,
+        top_p=0.8,
+        max_tokens=with_reasoning(2000),
+        response_format={"type": "json_object"}
+    )
+    try:
+        data = parse_model_json(response.choices[0].message.content)
+    except ValueError:
+        data = {}
+    if on_section:
+        for key in sections:
+            if conforms(data.get(key), SECTION_SPECS[key]["shape"]):
+                on_section(key, data[key])
+    return complete_analysis(client, data, project_text, "", on_section, sections=sections, grounded=grounded)
+
+def get_storytelling(client, project_text: str, tone: str):
+    return get_section_from_deepseek(client, "storytelling_script", project_text, tone)
+
+def get_sectioned_analysis(client, executor, project_text: str, tone: str, on_section=None,
+                           sections=ANALYSIS_SECTIONS):
+    # Возвращает тот же словарь, что и get_analysis_from_deepseek. Разделы,
+    # которые не удалось получить, отсутствуют в нём, а причина лежит в "section_errors".
+    if not client:
+        return None
+    futures = {executor.submit(get_section_from_deepseek, client, key, project_text, tone): key
+               for key in sections}
+    result = {}
+    errors = {}
+    for future in as_completed(futures):
+        key = futures[future]
+        try:
+            result[key] = future.result()
+        except Exception as e:
+            errors[key] = str(e)
+            continue
+        if on_section:
+            on_section(key, result[key])
+    if not result:
+        raise RuntimeError("; ".join(f"{key}: {error}" for key, error in errors.items()))
+    if errors:
+        result["section_errors"] = errors
+    return result
+
+# --- Повторная проверка исправленной версии: запрос только по изменениям ---
+DELTA_PROMPT_VERSION = DELTA_TEMPLATE.key
+GROUNDED_DELTA_PROMPT_VERSION = GROUNDED_DELTA_TEMPLATE.key
+DELTA_MAX_TOKENS = 1500
+
+def build_delta_messages(previous: dict, changed_text: str, removed: list, tone: str,
+                         grounded: bool = False) -> list:
+    previous = {key: previous[key] for key in without_fact_check(ANALYSIS_SECTIONS, grounded) if key in previous}
+    template = GROUNDED_DELTA_TEMPLATE if grounded else DELTA_TEMPLATE
+    return template.messages(previous=json.dumps(previous, ensure_ascii=False),
+                             removed="\n".join(f"- {title}" for title in removed) or "нет",
+                             changed=truncate_project_text(changed_text), tone=tone)
+
+def get_delta_analysis(client, previous: dict, changed_text: str, removed: list, tone: str,
+                       grounded: bool = False):
+    # Прошлый разбор с обновлёнными разделами и полем "changes". Разделы,
+    # которые модель вернула в неверном формате, остаются прежними
+    if not client:
+        return None
+    response = client.chat.completions.create(
+        model=ANALYSIS_MODEL,
+        messages=build_delta_messages(previous, changed_text, removed, tone, grounded),
+        temperature=0.5,
+        top_p=0.8,
+        max_tokens=with_reasoning(DELTA_MAX_TOKENS),
+        response_format={"type": "json_object"}
+    )
+    update = parse_model_json(response.choices[0].message.content)
+    sections = without_fact_check(ANALYSIS_SECTIONS, grounded)
+    result = {key: previous[key] for key in sections if key in previous}
+    for key in sections:
+        if conforms(update.get(key), SECTION_SPECS[key]["shape"]):
+            result[key] = update[key]
+    result["changes"] = update["changes"] if conforms(update.get("changes"), [str]) else []
+    return result
+
+# --- Проверка фактов по фрагментам слайдов ---
+FACT_CHECK_PROMPT_VERSION = FACT_CHECK_TEMPLATE.key
+FACT_CHECK_MAX_TOKENS = 1000
+
+def build_fact_check_messages(evidence: list) -> list:
+    # evidence — пары (утверждение, [(номер слайда, фрагмент)])
+    blocks = []
+    for idx, (claim, passages) in enumerate(evidence, start=1):
+        lines = [f"{idx}. {claim}"]
+        lines.extend(f"[Слайд {page}] {text}" for page, text in passages)
+        blocks.append("\n".join(lines))
+    return FACT_CHECK_TEMPLATE.messages(evidence="\n\n".join(blocks))
+
+def get_grounded_fact_check(client, evidence: list):
+    # Тот же формат, что у раздела fact_check, плюс "slides" — только номера
+    # слайдов, которые действительно были в запросе
+    response = client.chat.completions.create(
+        model=ANALYSIS_MODEL,
+        messages=build_fact_check_messages(evidence),
+        temperature=0.3,
+        top_p=0.8,
+        max_tokens=with_reasoning(FACT_CHECK_MAX_TOKENS),
+        response_format={"type": "json_object"}
+    )
+    value = _unwrap_section("fact_check", parse_model_json(response.choices[0].message.content))
+    if not conforms(value, SECTION_SPECS["fact_check"]["shape"]):
+        raise ValueError("модель вернула неполный раздел")
+    known = {page for _, passages in evidence for page, _ in passages}
+    for fact in value:
+        slides = fact.get("slides") if isinstance(fact.get("slides"), list) else []
+        fact["slides"] = sorted({int(page) for page in slides if str(page).isdigit() and int(page) in known})
+    return value
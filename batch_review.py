@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from analysis import NEBIUS_BASE_URL, TONES, make_client
+from ingest import DocumentIngestor
+from pipeline import MAX_IMAGE_CANDIDATES, analyze_document
+from result_cache import ResultCache
+
+
+# --- Пакетная проверка папки с презентациями без Streamlit ---
+# Файлы разбираются в пуле процессов, обращения к модели идут через
+# асинхронный пул с ограничением одновременных запусков и запусков в минуту.
+# Результаты дописываются в JSONL; файлы, чей SHA-256 уже есть в выходном
+# файле с успешным анализом, пропускаются, поэтому прерванный запуск можно
+# просто повторить.
+#
+#   DEEPSEEK_API_KEY=... python batch_review.py decks/ -o results.jsonl --concurrency 4 --rpm 30
+
+SUPPORTED_EXTENSIONS = (".pptx", ".pdf")
+
+
+def discover_files(root: str) -> list:
+    found = []
+    for directory, _, names in os.walk(root):
+        for name in sorted(names):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.startswith("~$"):
+                found.append(os.path.join(directory, name))
+    return sorted(found)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_mode(args) -> str:
+    if args.all_tones:
+        return "all_tones"
+    return "sectioned" if args.sectioned else "single"
+
+
+def load_finished(output_path: str) -> set:
+    # {(sha256, тон, режим)}: с другим тоном или режимом файл проверяется заново
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Обрезанная строка после аварийной остановки
+            if record.get("analysis"):
+                finished.add((record["sha256"], record.get("tone"), record.get("mode")))
+    return finished
+
+
+def parse_file(path: str):
+    # Выполняется в пуле процессов; сканы распознаются здесь же, без вложенного пула.
+    # Файл открывается по пути, целиком в память не читается
+    ingestor = DocumentIngestor(max_images=MAX_IMAGE_CANDIDATES, ocr_cache=ResultCache(table="analysis"))
+    return ingestor.ingest(path, path)
+
+
+class RateLimiter:
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def review_folder(args) -> int:
+    loop = asyncio.get_running_loop()
+    finished = load_finished(args.output)
+    mode = run_mode(args)
+    todo = []
+    skipped = 0
+    for path in discover_files(args.input_dir):
+        sha = file_sha256(path)
+        if (sha, args.tone, mode) in finished:
+            skipped += 1
+            continue
+        finished.add((sha, args.tone, mode))  # Одинаковые файлы в папке анализируем один раз
+        todo.append((path, sha))
+    print(f"Найдено к проверке: {len(todo)}, пропущено (уже есть результат): {skipped}", file=sys.stderr)
+    if not todo:
+        return 0
+
+    client = make_client(base_url=args.base_url)
+    cache = ResultCache(table="analysis")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limiter = RateLimiter(args.rpm)
+    # Документы анализируются в одном пуле, а их подзадачи (подписи, разделы,
+    # сводки фрагментов) — в другом, чтобы внешние задачи не заняли все потоки
+    document_pool = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="document")
+    request_pool = ThreadPoolExecutor(max_workers=args.concurrency * 4, thread_name_prefix="request")
+    failures = 0
+    done = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as parse_pool, \
+            open(args.output, "a", encoding="utf-8") as out:
+
+        async def review(path: str, sha: str):
+            nonlocal failures, done
+            started = time.perf_counter()
+            parsed = await loop.run_in_executor(parse_pool, parse_file, path)
+            timings = {"parse": time.perf_counter() - started}
+            if "ocr" in parsed.timings:
+                timings["ocr"] = parsed.timings["ocr"]
+            async with semaphore:
+                await limiter.acquire()
+                result = await loop.run_in_executor(
+                    document_pool,
+                    lambda: analyze_document(client, request_pool, cache, parsed, "", args.tone,
+                                             sectioned=args.sectioned, timings=timings,
+                                             all_tones=args.all_tones, revision_owner=os.path.abspath(path)),
+                )
+            record = {
+                "file": os.path.relpath(path, args.input_dir),
+                "sha256": sha,
+                "tone": args.tone,
+                "mode": mode,
+                "analysis": result.analysis,
+                "from_cache": result.from_cache,
+                "errors": result.errors,
+                "timings": result.timings,
+                "tokens_saved": result.tokens_saved,
+                "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            if not result.analysis:
+                failures += 1
+            status = "ok" if result.analysis else "ошибка"
+            print(f"[{done}/{len(todo)}] {record['file']}: {status}, "
+                  f"{time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+        try:
+            await asyncio.gather(*(review(path, sha) for path, sha in todo))
+        finally:
+            document_pool.shutdown(wait=False)
+            request_pool.shutdown(wait=False)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная проверка презентаций (.pptx, .pdf)")
+    parser.add_argument("input_dir", help="папка с презентациями (обходится рекурсивно)")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL-файл с результатами")
+    parser.add_argument("--tone", default=TONES[0], choices=TONES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2,
+                        help="процессов для разбора файлов")
+    parser.add_argument("--concurrency", type=int, default=4, help="документов в анализе одновременно")
+    parser.add_argument("--rpm", type=float, default=0, help="не больше запусков анализа в минуту (0 — без ограничения)")
+    parser.add_argument("--sectioned", action="store_true", help="параллельный анализ по разделам")
+    parser.add_argument("--all-tones", action="store_true",
+                        help="общие разделы один раз, сценарии сразу для всех тонов (в кэш)")
+    parser.add_argument("--base-url", default=NEBIUS_BASE_URL)
+    args = parser.parse_args()
+
+    failures = asyncio.run(review_folder(args))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
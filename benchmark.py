@@ -0,0 +1,301 @@
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import fitz
+import numpy as np
+from PIL import Image
+from pptx import Presentation
+from pptx.util import Inches
+
+from analysis import ANALYSIS_MODEL, TONES, build_analysis_messages, make_client
+from fake_llm_server import FakeLLMServer, add_fault_arguments, fault_options
+from ingest import DocumentIngestor
+from pipeline import MAX_IMAGE_CANDIDATES, run_pipeline
+from result_cache import ResultCache
+
+
+# --- Бенчмарк извлечения и всего конвейера анализа без Streamlit ---
+# Генерирует синтетические PPTX и PDF разного размера, замеряет этапы
+# DocumentIngestor (каждый случай — в отдельном процессе, чтобы пиковый RSS
+# не смешивался) и прогоняет run_pipeline против локальной заглушки API.
+#
+#   python benchmark.py --sizes 10,50,150 --repeats 5 --latency 0.5
+#   python benchmark.py --prompt-layout --prefill-latency 0.0005   (сравнение раскладки промпта)
+
+# Текст страниц разный: одинаковый абзац на каждой странице normalize.py
+# справедливо считает колонтитулом и вырезает, и замер шёл бы по пустым страницам
+SAMPLE_FACTS = (
+    "Манипулятор построен по логарифмической спирали и поднимает предметы в {weight} раз "
+    "тяжелее собственного веса.",
+    "Снижение повреждений донного грунта на {damage}% по сравнению с буксируемой драгой.",
+    "Скорость передвижения платформы до {speed} км/ч на рыхлом дне.",
+    "Автономная работа до 1,{battery} часов без подзарядки.",
+    "Прототип прошёл {dives} погружений в акватории залива.",
+    "Стоимость прототипа составила {cost} тыс. руб., серийного образца — вдвое меньше.",
+)
+
+
+def sample_paragraph(page: int) -> str:
+    facts = [fact.format(weight=200 + page * 3, damage=50 + page % 40, speed=10 + page % 7,
+                         battery=page % 9 + 1, dives=20 + page, cost=300 + page * 5)
+             for fact in SAMPLE_FACTS]
+    shift = page % len(facts)
+    return " ".join(facts[shift:] + facts[:shift])
+
+
+SAMPLE_PARAGRAPH = sample_paragraph(0)
+
+
+def _png(width: int, height: int, seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_pptx(slides: int) -> bytes:
+    prs = Presentation()
+    logo = _png(64, 64, seed=0)  # Повторяется на каждом слайде, как логотип вуза
+    for i in range(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = f"Слайд {i + 1}. Проект «Спрут»"
+        slide.placeholders[1].text = sample_paragraph(i)
+        slide.shapes.add_picture(io.BytesIO(logo), Inches(0.2), Inches(0.2), width=Inches(0.6))
+        if i % 3 == 0:
+            slide.shapes.add_picture(io.BytesIO(_png(320, 240, seed=i + 1)), Inches(5), Inches(4),
+                                     width=Inches(3))
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
+
+
+def make_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    logo = _png(64, 64, seed=0)
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_htmlbox(fitz.Rect(72, 72, 520, 400),
+                            f"<h2>Страница {i + 1}. Проект «Спрут»</h2><p>{sample_paragraph(i)}</p>")
+        page.insert_image(fitz.Rect(20, 20, 60, 60), stream=logo)
+        if i % 3 == 0:
+            page.insert_image(fitz.Rect(300, 450, 540, 630), stream=_png(320, 240, seed=i + 1))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: list) -> dict:
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "runs": len(values)}
+
+
+def _extract_case(path: str, repeats: int) -> dict:
+    # Выполняется в отдельном процессе: ru_maxrss — пик именно этого случая
+    with open(path, "rb") as f:
+        data = f.read()
+    stages = {}
+    for _ in range(repeats):
+        doc = DocumentIngestor(max_images=MAX_IMAGE_CANDIDATES).ingest(data, path)
+        for stage, seconds in doc.timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def bench_extraction(corpus: dict, repeats: int) -> list:
+    results = []
+    for (kind, size), path in corpus.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            case = pool.submit(_extract_case, path, repeats).result()
+        results.append({"bench": "extract", "kind": kind, "size": size, **case})
+    return results
+
+
+def bench_pipeline(corpus: dict, repeats: int, latency: float, token_latency: float,
+                   stream: bool, sectioned: bool, faults: dict = None, hedge: bool = False) -> list:
+    server = FakeLLMServer(latency=latency, token_latency=token_latency, **(faults or {})).start()
+    # Тот же устойчивый клиент, что и в приложении: повторы, лимит скорости, предохранитель
+    client = make_client(api_key="benchmark", base_url=server.url, requests_per_second=1000, hedge=hedge)
+    executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pipeline")
+    results = []
+    try:
+        for (kind, size), path in corpus.items():
+            with open(path, "rb") as f:
+                data = f.read()
+            stages = {}
+            server.reset_stats()
+            for _ in range(repeats):
+                upload = io.BytesIO(data)
+                upload.name = os.path.basename(path)
+                # Каждый прогон с пустым кэшем — меряем холодный путь
+                with tempfile.TemporaryDirectory() as cache_dir:
+                    cache = ResultCache(path=os.path.join(cache_dir, "bench.sqlite3"), table="analysis")
+                    run = run_pipeline(client, executor, cache, upload, "", "Вдохновляющий",
+                                       on_section=(lambda key, value: None) if stream else None,
+                                       sectioned=sectioned)
+                if run.errors:
+                    print(f"  ошибки: {run.errors}", file=sys.stderr)
+                for stage, seconds in run.timings.items():
+                    stages.setdefault(stage, []).append(seconds)
+            results.append({
+                "bench": "pipeline", "kind": kind, "size": size,
+                "stages": {stage: summarize(values) for stage, values in stages.items()},
+                "api_calls": dict(server.calls),
+                "injected_faults": dict(server.faults),
+                "api_calls_per_run": sum(server.calls.values()) / repeats,
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            })
+    finally:
+        executor.shutdown(wait=False)
+        server.stop()
+    return results
+
+
+def _legacy_messages(project_text: str, tone: str) -> list:
+    # Исходный промпт дословно: одно сообщение пользователя, тон в списке полей
+    # перед текстом проекта, обрезка по 20000 символов
+    if len(project_text) > 20000:
+        project_text = project_text[:20000] + "\n... (текст усечен для ускорения обработки)"
+    prompt = f"""
+Проанализируйте проект и верните строго валидный JSON с:
+1. "strengths": 3-5 сильных сторон (массив строк)
+2. "weaknesses": 3-5 слабых сторон с рекомендациями (массив строк)
+3. "fact_check": 3-4 проверки ключевых утверждений, будь придирчив и въедлив (массив объектов с полями claim, verdict, explanation)
+4. "storytelling_script": сценарий выступления ({tone}) - объект с полями introduction, main_part, conclusion
+5. "tricky_questions": 4-5 очень каверзных вопросов, как при защите диссертации (массив строк)
+
+Проект:
+{project_text}
+"""
+    return [{"role": "user", "content": prompt}]
+
+
+def bench_prompt_layout(documents: int, latency: float, prefill_latency: float) -> list:
+    # Одни и те же документы во всех тонах, как при повторных проверках:
+    # меряем время до первого токена и долю закэшированного префикса на заглушке
+    layouts = {"legacy": _legacy_messages, "template": build_analysis_messages}
+    texts = [f"Документ {doc}.\n" + (SAMPLE_PARAGRAPH + "\n") * 40 for doc in range(documents)]
+    server = FakeLLMServer(latency=latency, prefill_latency=prefill_latency).start()
+    client = make_client(api_key="benchmark", base_url=server.url, requests_per_second=1000)
+    results = []
+    try:
+        for layout, build in layouts.items():
+            server.reset_stats()
+            first_tokens = []
+            for text in texts:
+                for tone in TONES:
+                    start_time = time.perf_counter()
+                    stream = client.chat.completions.create(model=ANALYSIS_MODEL, messages=build(text, tone),
+                                                            max_tokens=2000, stream=True)
+                    for _ in stream:
+                        first_tokens.append(time.perf_counter() - start_time)
+                        break
+                    for _ in stream:
+                        pass
+            requests = len(first_tokens)
+            results.append({
+                "bench": "prompt", "kind": layout, "size": requests,
+                "stages": {"first_token": summarize(first_tokens)},
+                "prompt_tokens_per_call": server.tokens["prompt"] / requests,
+                "cached_share": server.tokens["cached"] / max(1, server.tokens["prompt"]),
+            })
+    finally:
+        server.stop()
+    return results
+
+
+def print_report(results: list):
+    for result in results:
+        if result["bench"] == "prompt":
+            first_token = result["stages"]["first_token"]
+            print(f"prompt   {result['kind']:<8} {result['size']:>4} запр.  первый токен p50 "
+                  f"{first_token['p50']:.3f} с  p95 {first_token['p95']:.3f} с  "
+                  f"токенов запроса {result['prompt_tokens_per_call']:.0f}, "
+                  f"из кэша {result['cached_share']:.0%}")
+            continue
+        title = f"{result['bench']:<8} {result['kind']:<4} {result['size']:>4} стр."
+        total = result["stages"].get("total", {})
+        print(f"{title}  p50 {total.get('p50', 0):.3f} с  p95 {total.get('p95', 0):.3f} с  "
+              f"пик RSS {result['peak_rss_mb']:.1f} МБ")
+        for stage, stats in result["stages"].items():
+            if stage != "total":
+                print(f"    {stage:<14} p50 {stats['p50']:.3f} с  p95 {stats['p95']:.3f} с")
+        if "api_calls" in result:
+            print(f"    вызовы API за прогон: {result['api_calls_per_run']:.1f}  {result['api_calls']}")
+            if result.get("injected_faults"):
+                print(f"    внесённые сбои: {result['injected_faults']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения и анализа")
+    parser.add_argument("--sizes", default="10,50,150", help="размеры документов через запятую")
+    parser.add_argument("--kinds", default="pptx,pdf")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка заглушки API, сек")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="задержка на токен ответа, сек")
+    parser.add_argument("--stream", action="store_true", help="потоковый режим анализа")
+    parser.add_argument("--sectioned", action="store_true", help="параллельный анализ по разделам")
+    parser.add_argument("--skip-pipeline", action="store_true", help="только извлечение")
+    parser.add_argument("--hedge", action="store_true", help="дублировать запросы дольше p95")
+    parser.add_argument("--prompt-layout", action="store_true",
+                        help="только сравнение раскладки промпта: время до первого токена и кэш префикса")
+    parser.add_argument("--prefill-latency", type=float, default=0.0005,
+                        help="задержка заглушки на не закэшированный токен запроса, сек")
+    add_fault_arguments(parser)
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    if args.prompt_layout:
+        results = bench_prompt_layout(args.repeats, args.latency, args.prefill_latency)
+        print_report(results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        return
+
+    makers = {"pptx": make_pptx, "pdf": make_pdf}
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        corpus = {}
+        for kind in args.kinds.split(","):
+            for size in sizes:
+                path = os.path.join(corpus_dir, f"synthetic_{size}.{kind}")
+                with open(path, "wb") as f:
+                    f.write(makers[kind](size))
+                corpus[(kind, size)] = path
+
+        started = time.perf_counter()
+        results = bench_extraction(corpus, args.repeats)
+        if not args.skip_pipeline:
+            results += bench_pipeline(corpus, args.repeats, args.latency, args.token_latency,
+                                      args.stream, args.sectioned, fault_options(args), args.hedge)
+
+    print_report(results)
+    print(f"Бенчмарк занял {time.perf_counter() - started:.1f} с")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import hashlib
+import math
+import re
+
+
+# --- Оценка длины в токенах и нарезка текста на фрагменты ---
+# Точного токенизатора DeepSeek под рукой нет, поэтому считаем по словам:
+# кириллица в BPE-словарях дробится заметно мельче латиницы, а каждая
+# цифра-группа и знак препинания обычно становятся отдельным токеном.
+
+CYRILLIC_CHARS_PER_TOKEN = 2.5
+LATIN_CHARS_PER_TOKEN = 4.0
+DIGITS_PER_TOKEN = 3.0
+
+_TOKEN_PATTERN = re.compile(r"([А-Яа-яЁё]+)|([A-Za-z]+)|(\d+)|(\S)")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_PAGE_HEADER = re.compile(r"^## ")
+
+# Границы фрагментов по содержимому: фрагмент закрывается после страницы,
+# чей хэш делится на делитель. Правка одного слайда меняет только его фрагмент,
+# а соседние остаются прежними и берутся из кэша сводок
+BOUNDARY_DIVISOR = 4
+MIN_CHUNK_SHARE = 0.25  # Не закрываем фрагмент по хэшу, пока он меньше четверти лимита
+
+
+def estimate_tokens(text: str) -> int:
+    tokens = 0
+    for cyrillic, latin, digits, _ in _TOKEN_PATTERN.findall(text):
+        if cyrillic:
+            tokens += math.ceil(len(cyrillic) / CYRILLIC_CHARS_PER_TOKEN)
+        elif latin:
+            tokens += math.ceil(len(latin) / LATIN_CHARS_PER_TOKEN)
+        elif digits:
+            tokens += math.ceil(len(digits) / DIGITS_PER_TOKEN)
+        else:
+            tokens += 1
+    return tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int, note: str = "") -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    used = 0
+    for line in text.split("\n"):
+        line_tokens = estimate_tokens(line) + 1
+        if used + line_tokens > max_tokens:
+            break
+        kept.append(line)
+        used += line_tokens
+    return "\n".join(kept) + note
+
+
+def _split_oversized(piece: str, max_tokens: int) -> list:
+    # Слишком длинный абзац режем по предложениям, а предложения — по словам
+    parts = []
+    for sentence in _SENTENCE_END.split(piece):
+        if estimate_tokens(sentence) <= max_tokens:
+            parts.append(sentence)
+            continue
+        words = []
+        words_tokens = 0
+        for word in sentence.split():
+            word_tokens = estimate_tokens(word)
+            if words and words_tokens + word_tokens > max_tokens:
+                parts.append(" ".join(words))
+                words = []
+                words_tokens = 0
+            words.append(word)
+            words_tokens += word_tokens
+        if words:
+            parts.append(" ".join(words))
+    return parts
+
+
+def split_into_chunks(text: str, max_tokens: int) -> list:
+    pieces = []
+    for line in text.split("\n"):
+        if not line.strip():
+            continue
+        if estimate_tokens(line) > max_tokens:
+            pieces.extend(_split_oversized(line, max_tokens))
+        else:
+            pieces.append(line)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = estimate_tokens(piece) + 1
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def split_pages_into_chunks(text: str, max_tokens: int) -> list:
+    # Текст ParsedDocument.text: страницы начинаются с «## ». Без заголовков
+    # (например, только текст доклада) — обычная нарезка
+    pages = []
+    for line in text.split("\n"):
+        if _PAGE_HEADER.match(line) or not pages:
+            pages.append([line])
+        else:
+            pages[-1].append(line)
+    if len(pages) < 2:
+        return split_into_chunks(text, max_tokens)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for lines in pages:
+        page = "\n".join(lines).strip()
+        if not page:
+            continue
+        page_tokens = estimate_tokens(page) + 1
+        if page_tokens > max_tokens:
+            if current:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(split_into_chunks(page, max_tokens))
+            continue
+        if current and current_tokens + page_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(page)
+        current_tokens += page_tokens
+        body = page.split("\n", 1)[-1]  # Без заголовка с номером страницы
+        boundary = int(hashlib.sha1(body.encode("utf-8")).hexdigest()[:8], 16) % BOUNDARY_DIVISOR == 0
+        if boundary and current_tokens >= max_tokens * MIN_CHUNK_SHARE:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
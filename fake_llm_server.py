@@ -0,0 +1,331 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chunking import estimate_tokens
+
+
+# --- Локальная заглушка OpenAI-совместимого API для бенчмарков ---
+# Отвечает на POST /v1/chat/completions правдоподобными ответами для всех
+# наших запросов (анализ целиком, отдельный раздел, сводка, подписи к
+# картинкам), поддерживает stream=True и настраиваемую задержку.
+# Умеет вносить сбои: доля ответов 500, доля 429 с Retry-After и доля
+# «медленных» ответов — для проверки повторов, предохранителя и дублирования.
+# Имитирует кэш префиксов провайдера: общий с недавними запросами префикс
+# (блоками по PREFIX_BLOCK_CHARS символов) не тарифицируется задержкой prefill
+# и возвращается в usage.prompt_tokens_details.cached_tokens.
+# Для моделей-«рассуждателей» (DeepSeek-R1) может добавлять перед ответом блок
+# <think>…</think> заданной длины; ответ обрезается по max_tokens запроса
+# (finish_reason="length"), как у настоящего API.
+# GET /stats возвращает число вызовов по моделям, токены и внесённые сбои.
+#
+#   python fake_llm_server.py --port 8765 --latency 1.5 --token-latency 0.002
+#   python fake_llm_server.py --error-rate 0.1 --throttle-rate 0.2 --retry-after 1
+#   python fake_llm_server.py --reasoning-tokens 1500
+
+FAKE_ANALYSIS = {
+    "strengths": ["Чётко сформулирована проблема", "Есть работающий прототип", "Сильная команда"],
+    "weaknesses": ["Нет сравнения с аналогами — добавьте таблицу", "Мало данных испытаний — приведите выборку"],
+    "fact_check": [
+        {"claim": "Снижение повреждений на 72%", "verdict": "Требует уточнения",
+         "explanation": "Не указана методика измерения"},
+    ],
+    "storytelling_script": {
+        "introduction": "Представьте океан без разрушений.",
+        "main_part": "Мы создали манипулятор, который бережно собирает конкреции.",
+        "conclusion": "Технологии должны быть союзниками природы.",
+    },
+    "tricky_questions": ["Как вы измеряли повреждение грунта?", "Чем вы лучше существующих драг?"],
+}
+
+REASONING_MODELS = {"deepseek-ai/DeepSeek-R1"}
+REASONING_FILLER = "Рассмотрим проект по шагам и проверим ключевые утверждения. "
+
+PREFIX_BLOCK_CHARS = 256
+PREFIX_CACHE_ENTRIES = 64
+
+_SINGLE_SECTION = re.compile(r'единственным полем:\s*"(\w+)"')
+
+
+def _message_text(messages: list) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+def _prompt_string(messages: list) -> str:
+    # Префикс сравнивается по сообщениям в порядке отправки, с ролями
+    return "".join(f"<{message.get('role')}>{_message_text([message])}" for message in messages)
+
+
+def _image_count(messages: list) -> int:
+    return sum(1 for message in messages if isinstance(message.get("content"), list)
+               for part in message["content"] if part.get("type") == "image_url")
+
+
+def fake_completion(body: dict) -> str:
+    messages = body.get("messages", [])
+    images = _image_count(messages)
+    if images:
+        return "\n".join(f"#{idx}: Тестовое изображение {idx}" for idx in range(1, images + 1))
+    if body.get("response_format", {}).get("type") == "json_object":
+        match = _SINGLE_SECTION.search(_message_text(messages))
+        if match and match.group(1) in FAKE_ANALYSIS:
+            return json.dumps({match.group(1): FAKE_ANALYSIS[match.group(1)]}, ensure_ascii=False)
+        return json.dumps(FAKE_ANALYSIS, ensure_ascii=False)
+    return "Сводка фрагмента: проект, цели, ключевые числа 72%, 260 раз, 15 км/ч."
+
+
+def reasoning_block(tokens: int) -> str:
+    if tokens <= 0:
+        return ""
+    repeats = tokens // max(1, estimate_tokens(REASONING_FILLER)) + 1
+    return f"<think>\n{REASONING_FILLER * repeats}\n</think>\n"
+
+
+def truncate_completion(content: str, max_tokens: int) -> tuple:
+    # (текст, finish_reason): обрезка по оценке токенов, двоичным поиском по длине
+    if not max_tokens or estimate_tokens(content) <= max_tokens:
+        return content, "stop"
+    low, high = 0, len(content)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(content[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return content[:low], "length"
+
+
+class FakeLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_latency=0.0,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=1.0, slow_rate=0.0, slow_latency=10.0,
+                 prefill_latency=0.0, reasoning_tokens=0):
+        self.latency = latency  # Задержка до первого байта ответа, сек
+        self.token_latency = token_latency  # Задержка на каждый токен ответа, сек
+        self.prefill_latency = prefill_latency  # Задержка на каждый не закэшированный токен запроса, сек
+        self.reasoning_tokens = reasoning_tokens  # Длина блока <think> в ответах REASONING_MODELS
+        self.error_rate = error_rate  # Доля ответов 500
+        self.throttle_rate = throttle_rate  # Доля ответов 429
+        self.retry_after = retry_after  # Значение Retry-After в ответах 429, сек
+        self.slow_rate = slow_rate  # Доля ответов с задержкой slow_latency вместо latency
+        self.slow_latency = slow_latency
+        self.calls = Counter()
+        self.faults = Counter()
+        self.tokens = Counter()  # prompt / cached / completion
+        self._prefixes = deque(maxlen=PREFIX_CACHE_ENTRIES)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.faults.clear()
+            self.tokens.clear()
+            self._prefixes.clear()
+
+    def _record(self, model: str):
+        with self._lock:
+            self.calls[model] += 1
+
+    def _cached_prefix(self, prompt: str) -> str:
+        with self._lock:
+            longest = max((len(_common_prefix(prompt, seen)) for seen in self._prefixes), default=0)
+            self._prefixes.append(prompt)
+        return prompt[:longest - longest % PREFIX_BLOCK_CHARS]
+
+    def _record_tokens(self, usage: dict):
+        with self._lock:
+            self.tokens["prompt"] += usage["prompt_tokens"]
+            self.tokens["cached"] += usage["prompt_tokens_details"]["cached_tokens"]
+            self.tokens["completion"] += usage["completion_tokens"]
+
+    def _pick_fault(self):
+        roll = random.random()
+        if roll < self.error_rate:
+            fault = "error"
+        elif roll < self.error_rate + self.throttle_rate:
+            fault = "throttle"
+        elif roll < self.error_rate + self.throttle_rate + self.slow_rate:
+            fault = "slow"
+        else:
+            return None
+        with self._lock:
+            self.faults[fault] += 1
+        return fault
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    with server._lock:
+                        self._send_json(200, {"calls": dict(server.calls), "faults": dict(server.faults),
+                                              "tokens": dict(server.tokens)})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                model = body.get("model", "")
+                server._record(model)
+                fault = server._pick_fault()
+                if fault == "error":
+                    self._send_json(500, {"error": {"message": "injected server error", "type": "server_error"}})
+                    return
+                if fault == "throttle":
+                    self._send_json(429, {"error": {"message": "injected rate limit", "type": "rate_limit"}},
+                                    headers={"Retry-After": str(server.retry_after)})
+                    return
+                content = fake_completion(body)
+                if model in REASONING_MODELS:
+                    content = reasoning_block(server.reasoning_tokens) + content
+                content, finish_reason = truncate_completion(content, body.get("max_tokens"))
+                messages = body.get("messages", [])
+                cached_tokens = estimate_tokens(server._cached_prefix(_prompt_string(messages)))
+                usage = {
+                    "prompt_tokens": estimate_tokens(_message_text(messages)),
+                    "completion_tokens": estimate_tokens(content),
+                }
+                cached_tokens = min(cached_tokens, usage["prompt_tokens"])
+                usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                server._record_tokens(usage)
+                prefill = server.prefill_latency * (usage["prompt_tokens"] - cached_tokens)
+                time.sleep((server.slow_latency if fault == "slow" else server.latency) + prefill)
+                if body.get("stream"):
+                    self._stream(model, content, usage, finish_reason)
+                    return
+                time.sleep(server.token_latency * usage["completion_tokens"])
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": finish_reason,
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                })
+
+            def _stream(self, model: str, content: str, usage: dict, finish_reason: str = "stop"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                step = 16  # Символов в одном фрагменте
+                pieces = [content[i:i + step] for i in range(0, len(content), step)]
+                for i, piece in enumerate(pieces):
+                    finish = finish_reason if i == len(pieces) - 1 else None
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": finish}],
+                    }
+                    if finish:
+                        chunk["usage"] = usage
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(server.token_latency * estimate_tokens(piece))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def _common_prefix(a: str, b: str) -> str:
+    # Двоичный поиск по сравнению срезов: быстрее посимвольного цикла на длинных промптах
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return a[:low]
+
+
+def add_fault_arguments(parser):
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After для 429, сек")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов")
+    parser.add_argument("--slow-latency", type=float, default=10.0, help="задержка медленного ответа, сек")
+
+
+def fault_options(args) -> dict:
+    return {"error_rate": args.error_rate, "throttle_rate": args.throttle_rate, "retry_after": args.retry_after,
+            "slow_rate": args.slow_rate, "slow_latency": args.slow_latency}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка до первого байта, сек")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="задержка на токен ответа, сек")
+    parser.add_argument("--prefill-latency", type=float, default=0.0,
+                        help="задержка на не закэшированный токен запроса, сек")
+    parser.add_argument("--reasoning-tokens", type=int, default=0,
+                        help="длина блока <think> в ответах DeepSeek-R1, токенов")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    server = FakeLLMServer(args.host, args.port, args.latency, args.token_latency, **fault_options(args),
+                           prefill_latency=args.prefill_latency, reasoning_tokens=args.reasoning_tokens)
+    print(f"Заглушка API слушает {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+
+# --- Дедупликация изображений по перцептивному хэшу ---
+# В презентациях на каждом слайде повторяются логотип, фон и элементы шаблона.
+# Для каждой картинки считаем pHash по уменьшенной серой копии, склеиваем
+# почти одинаковые и выбираем самые информативные из оставшихся.
+
+HASH_SIZE = 8  # 64-битный хэш
+PHASH_SIDE = 32
+MAX_HAMMING_DISTANCE = 10  # До этого расстояния картинки считаются одинаковыми
+REPEATED_IMAGE_MIN = 3  # Встречается на стольких слайдах — скорее всего элемент шаблона
+
+
+def _grayscale(img_data: bytes, side: int) -> np.ndarray:
+    with Image.open(io.BytesIO(img_data)) as img:
+        gray = img.convert("L").resize((side, side), Image.LANCZOS)
+        return np.asarray(gray, dtype=np.float64)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(PHASH_SIDE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(pixels: np.ndarray) -> int:
+    # Низкочастотные коэффициенты DCT сравниваются с медианой (без DC-составляющей)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+def entropy(pixels: np.ndarray) -> float:
+    # Энтропия яркости: у логотипов и заливок она низкая, у фото и графиков — высокая
+    histogram = np.bincount(pixels.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    p = histogram[histogram > 0] / histogram.sum()
+    return float(-(p * np.log2(p)).sum())
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def hash_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def select_distinct_images(images: list, repeats: list = None, limit: int = 3) -> list:
+    """Возвращает до limit пар (изображение, pHash в hex) без почти-дубликатов.
+
+    repeats[i] — на скольких слайдах/страницах встретилось images[i]; часто
+    повторяющиеся картинки (логотипы, фон) берутся только если больше нечего.
+    """
+    repeats = repeats or [1] * len(images)
+    candidates = []
+    for img_data, count in zip(images, repeats):
+        try:
+            pixels = _grayscale(img_data, PHASH_SIDE)
+        except Exception:
+            continue  # Форматы, которые Pillow не читает (EMF/WMF), пропускаем
+        candidates.append({"image": img_data, "phash": phash(pixels), "count": count,
+                           "entropy": entropy(pixels)})
+
+    # Склеиваем почти одинаковые картинки, суммируя число повторов
+    clusters = []
+    for candidate in candidates:
+        for cluster in clusters:
+            if hamming(cluster["phash"], candidate["phash"]) <= MAX_HAMMING_DISTANCE:
+                cluster["count"] += candidate["count"]
+                if candidate["entropy"] > cluster["entropy"]:
+                    cluster.update(image=candidate["image"], phash=candidate["phash"],
+                                   entropy=candidate["entropy"])
+                break
+        else:
+            clusters.append(dict(candidate))
+
+    clusters.sort(key=lambda c: (c["count"] >= REPEATED_IMAGE_MIN, -c["entropy"]))
+    return [(c["image"], hash_hex(c["phash"])) for c in clusters[:limit]]
@@ -0,0 +1,364 @@
+import hashlib
+import io
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+import fitz
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE, PP_PLACEHOLDER
+
+from image_dedup import REPEATED_IMAGE_MIN
+from normalize import normalize_document, pdf_edge_lines, shape_at_edge
+from ocr import MAX_OCR_PAGES, needs_ocr, ocr_cache_key, ocr_page, page_hash, single_page_pdf
+
+
+# --- Однопроходное извлечение данных из загруженного файла ---
+# Файл открывается один раз, за один обход собираются текст, изображения
+# и постраничная структура. Модуль не зависит от Streamlit: ошибки
+# складываются в ParsedDocument.errors, а показывает их интерфейс.
+
+MIN_IMAGE_SIDE = 32  # Иконки и маркеры списков меньше этого не рассматриваем
+MAX_CHART_POINTS = 12  # Значений одного ряда диаграммы в тексте, остальное — «…»
+
+TITLE_PLACEHOLDERS = (PP_PLACEHOLDER.TITLE, PP_PLACEHOLDER.CENTER_TITLE, PP_PLACEHOLDER.VERTICAL_TITLE)
+# Колонтитулы слайда: в промпт не попадают вовсе
+FOOTER_PLACEHOLDERS = (PP_PLACEHOLDER.FOOTER, PP_PLACEHOLDER.SLIDE_NUMBER, PP_PLACEHOLDER.DATE)
+
+@dataclass
+class PageRecord:
+    number: int  # Номер слайда/страницы, начиная с 1
+    text: str = ""  # Для слайда — текст без заголовка, таблиц и заметок
+    image_count: int = 0
+    title: str = ""
+    tables: list = field(default_factory=list)  # Таблица — список строк, строка — список ячеек
+    charts: list = field(default_factory=list)  # Уже сериализованные диаграммы
+    notes: str = ""
+    image_refs: list = field(default_factory=list)  # Индексы в ParsedDocument.images
+    ocr: bool = False  # Текст получен распознаванием скана
+    edge_lines: list = field(default_factory=list)  # Строки у верхнего/нижнего края (normalize.py)
+
+    def serialize(self, kind: str) -> str:
+        # Компактное представление для промпта: заголовок с номером, затем
+        # только непустые части, таблицы строками через « | »
+        label = "Слайд" if kind == "pptx" else "Стр."
+        lines = [f"## {label} {self.number}" + (f": {self.title}" if self.title else "")]
+        if self.text:
+            lines.append(self.text)
+        for table in self.tables:
+            lines.append("Таблица:")
+            lines.extend(" | ".join(row) for row in table)
+        lines.extend(f"Диаграмма: {chart}" for chart in self.charts)
+        if self.notes:
+            lines.append(f"Заметки: {self.notes}")
+        return "\n".join(lines)
+
+    @property
+    def fingerprint(self) -> str:
+        # Хэш содержимого без номера: слайд, сдвинутый вставкой, считается тем же
+        content = [self.title, self.text, self.tables, self.charts, self.notes]
+        return hashlib.sha1(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @property
+    def has_content(self) -> bool:
+        return bool(self.title or self.text or self.tables or self.charts or self.notes)
+
+
+@dataclass
+class ParsedDocument:
+    kind: str  # "pptx" или "pdf"
+    source: str = ""  # Имя загруженного файла
+    pages: list = field(default_factory=list)
+    images: list = field(default_factory=list)
+    image_repeats: list = field(default_factory=list)  # Сколько раз встретилось каждое изображение
+    timings: dict = field(default_factory=dict)
+    errors: list = field(default_factory=list)
+    # Отобранные для подписей изображения (pHash и т.п.) — считаются один раз
+    # на документ, даже если документ повторно берётся из ParsedDocumentStore
+    selected_images: list = None
+    tokens_saved: int = 0  # Оценка токенов, убранных вместе с колонтитулами и переносами
+    # Численные утверждения с фрагментами слайдов для проверки фактов (passage_index.py)
+    fact_evidence: list = None
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(page.serialize(self.kind) for page in self.pages if page.has_content)
+
+
+class DocumentIngestor:
+    def __init__(self, max_images=3, max_image_bytes=500000,
+                 max_text_pages=None, max_image_pages=6,
+                 ocr_pool=None, ocr_cache=None, max_ocr_pages=MAX_OCR_PAGES):
+        self.max_images = max_images
+        self.max_image_bytes = max_image_bytes  # Только изображения меньше 500KB
+        # Для PDF: текст со всех страниц (None) — длинные документы потом сжимаются
+        # map-reduce суммаризацией, а не обрезаются
+        self.max_text_pages = max_text_pages
+        self.max_image_pages = max_image_pages  # Для PDF: изображения с первых 6 страниц
+        # Для PDF без текстового слоя: пул процессов для OCR (None — в текущем
+        # процессе), кэш распознанных страниц и бюджет страниц на документ
+        self.ocr_pool = ocr_pool
+        self.ocr_cache = ocr_cache
+        self.max_ocr_pages = max_ocr_pages
+
+    def ingest_upload(self, uploaded_file, on_images=None) -> ParsedDocument:
+        # SpooledUpload (uploads.py) открываем по пути, без чтения в память
+        if hasattr(uploaded_file, "path"):
+            return self.ingest(uploaded_file.path, uploaded_file.name, on_images)
+        return self.ingest(uploaded_file.getvalue(), uploaded_file.name, on_images)
+
+    def ingest(self, data, file_name: str, on_images=None) -> ParsedDocument:
+        # data — содержимое файла (bytes) или путь к нему. on_images(doc) вызывается,
+        # как только изображения собраны, — до OCR и нормализации текста: подписи
+        # к ним можно запускать, не дожидаясь конца разбора
+        name = file_name.lower()
+        if name.endswith(".pptx"):
+            doc = ParsedDocument(kind="pptx", source=os.path.basename(file_name))
+            walker = self._walk_pptx
+        elif name.endswith(".pdf"):
+            doc = ParsedDocument(kind="pdf", source=os.path.basename(file_name))
+            walker = self._walk_pdf
+        else:
+            raise ValueError(f"Неподдерживаемый формат файла: {file_name}")
+
+        start_time = time.perf_counter()
+        walker(data, doc, on_images)
+        normalize_start = time.perf_counter()
+        doc.tokens_saved = normalize_document(doc)
+        doc.timings["normalize"] = time.perf_counter() - normalize_start
+        doc.timings["total"] = time.perf_counter() - start_time
+        return doc
+
+    def _accept_image(self, doc: ParsedDocument, blob: bytes, seen: dict, repeats: int = 1):
+        # Возвращает индекс изображения в doc.images или None, если оно не принято
+        if len(blob) >= self.max_image_bytes:
+            return None
+        # Одинаковые картинки (логотип на каждом слайде) храним один раз
+        digest = hashlib.sha1(blob).hexdigest()
+        if digest in seen:
+            doc.image_repeats[seen[digest]] += repeats
+            return seen[digest]
+        if len(doc.images) >= self.max_images:
+            return None
+        seen[digest] = len(doc.images)
+        doc.images.append(blob)
+        doc.image_repeats.append(repeats)
+        return seen[digest]
+
+    def _walk_pptx(self, data, doc: ParsedDocument, on_images=None):
+        try:
+            start_time = time.perf_counter()
+            prs = Presentation(io.BytesIO(data) if isinstance(data, bytes) else data)
+            doc.timings["open"] = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            seen = {}
+            for number, slide in enumerate(prs.slides, start=1):
+                page = PageRecord(number=number)
+                body = []
+                self._walk_shapes(doc, page, slide.shapes, body, seen, prs.slide_height)
+                page.text = "\n".join(body)
+                notes_frame = slide.notes_slide.notes_text_frame if slide.has_notes_slide else None
+                if notes_frame is not None:
+                    page.notes = _clean(notes_frame.text)
+                doc.pages.append(page)
+            doc.timings["walk"] = time.perf_counter() - start_time
+            if on_images is not None:
+                on_images(doc)
+        except Exception as e:
+            doc.errors.append(f"Ошибка при чтении файла презентации: {e}")
+
+    def _walk_shapes(self, doc: ParsedDocument, page: PageRecord, shapes, body: list, seen: dict, slide_height):
+        # Рекурсивно: фигуры внутри групп обходятся так же, как на слайде
+        for shape in shapes:
+            shape_type = getattr(shape, "shape_type", None)
+            if shape_type == MSO_SHAPE_TYPE.GROUP:
+                self._walk_shapes(doc, page, shape.shapes, body, seen, slide_height)
+            elif shape.has_table:
+                rows = [[_clean(cell.text) for cell in row.cells] for row in shape.table.rows]
+                rows = [row for row in rows if any(row)]
+                if rows:
+                    page.tables.append(rows)
+            elif shape.has_chart:
+                chart = _describe_chart(shape.chart)
+                if chart:
+                    page.charts.append(chart)
+            elif shape_type == MSO_SHAPE_TYPE.PICTURE and hasattr(shape, "image"):
+                index = self._accept_image(doc, shape.image.blob, seen)
+                if index is not None:
+                    page.image_count += 1
+                    page.image_refs.append(index)
+            elif shape.has_text_frame:
+                # paragraph.text включает поля и мягкие переносы (a:br -> "\v"), в отличие от runs
+                paragraphs = [_clean(paragraph.text.replace("\v", "\n"))
+                              for paragraph in shape.text_frame.paragraphs]
+                text = "\n".join(paragraph for paragraph in paragraphs if paragraph)
+                if not text or _placeholder_type(shape) in FOOTER_PLACEHOLDERS:
+                    continue
+                if not page.title and _placeholder_type(shape) in TITLE_PLACEHOLDERS:
+                    page.title = text.replace("\n", " ")
+                else:
+                    body.append(text)
+                    if shape_at_edge(shape, slide_height):
+                        page.edge_lines.extend(text.splitlines())
+
+    def _walk_pdf(self, data, doc: ParsedDocument, on_images=None):
+        try:
+            start_time = time.perf_counter()
+            # По пути MuPDF читает файл сам, без копии содержимого в памяти Python
+            if isinstance(data, bytes):
+                opened = fitz.open(stream=data, filetype="pdf")
+            else:
+                opened = fitz.open(data, filetype="pdf")
+            with opened as pdf:
+                doc.timings["open"] = time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                image_refs = {}
+                scanned = []  # Номера страниц без текстового слоя
+                text_pages = len(pdf) if self.max_text_pages is None else self.max_text_pages
+                last_page = max(text_pages, self.max_image_pages)
+                for page_num, pdf_page in enumerate(pdf):
+                    if page_num >= last_page:
+                        break
+                    page = PageRecord(number=page_num + 1)
+                    if page_num < text_pages:
+                        page.text = pdf_page.get_text()
+                        page.edge_lines = pdf_edge_lines(pdf_page)
+                        if self.max_ocr_pages and needs_ocr(pdf_page, page.text):
+                            scanned.append(page_num)
+                    if page_num < self.max_image_pages:
+                        # Пока только метаданные: сами изображения декодируются позже и не все
+                        for img_ref in pdf_page.get_images(full=True):
+                            xref, _, width, height = img_ref[:4]
+                            page.image_count += 1
+                            if xref in image_refs:
+                                image_refs[xref]["repeats"] += 1
+                            else:
+                                image_refs[xref] = {"width": width, "height": height, "repeats": 1}
+                    doc.pages.append(page)
+                doc.timings["walk"] = time.perf_counter() - start_time
+
+                # Изображения раньше OCR: подписи к ним идут, пока распознаются сканы
+                start_time = time.perf_counter()
+                seen = {}
+                for blob, repeats in self._iter_pdf_images(pdf, image_refs):
+                    self._accept_image(doc, blob, seen, repeats)
+                    if len(doc.images) >= self.max_images:
+                        break
+                doc.timings["images"] = time.perf_counter() - start_time
+                if on_images is not None:
+                    on_images(doc)
+
+                if scanned:
+                    start_time = time.perf_counter()
+                    self._ocr_pages(pdf, doc, scanned)
+                    doc.timings["ocr"] = time.perf_counter() - start_time
+        except Exception as e:
+            doc.errors.append(f"Ошибка при чтении PDF-файла: {e}")
+
+    def _ocr_pages(self, pdf, doc: ParsedDocument, page_nums: list):
+        # Бюджет страниц — до хэширования: страницы сверх него не читаются вовсе.
+        # Из оставшихся сначала кэш по хэшу страницы, остальное — в пул процессов
+        skipped = len(page_nums) - self.max_ocr_pages
+        if skipped > 0:
+            doc.errors.append(f"Распознаны не все сканированные страницы: пропущено {skipped}")
+        pending = {}
+        for page_num in page_nums[:self.max_ocr_pages]:
+            key = ocr_cache_key(page_hash(pdf, pdf[page_num]))
+            text = self.ocr_cache.get(key) if self.ocr_cache is not None else None
+            if text is not None:
+                doc.pages[page_num].text = text
+                doc.pages[page_num].ocr = True
+            else:
+                pending[page_num] = key
+
+        futures = {}
+        if self.ocr_pool is not None:
+            futures = {page_num: self.ocr_pool.submit(ocr_page, single_page_pdf(pdf, page_num))
+                       for page_num in pending}
+        for page_num, key in pending.items():
+            try:
+                if page_num in futures:
+                    text = futures[page_num].result()
+                else:
+                    text = ocr_page(single_page_pdf(pdf, page_num))
+            except Exception as e:
+                # Чаще всего — не установлен Tesseract; остальные страницы не ждём
+                for future in futures.values():
+                    future.cancel()
+                doc.errors.append(f"Не удалось распознать сканированные страницы: {e}")
+                break
+            doc.pages[page_num].text = text
+            doc.pages[page_num].ocr = True
+            if self.ocr_cache is not None:
+                self.ocr_cache.set(key, text)
+
+    def _iter_pdf_images(self, pdf, image_refs: dict):
+        # Ленивый генератор: кандидаты отбираются и ранжируются по метаданным xref
+        # (размеры, длина потока), а extract_image вызывается только для тех,
+        # что реально понадобятся. Часто повторяющиеся картинки идут в конце
+        ranked = sorted(
+            image_refs.items(),
+            key=lambda item: (item[1]["repeats"] >= REPEATED_IMAGE_MIN, -item[1]["width"] * item[1]["height"]),
+        )
+        for xref, meta in ranked:
+            if min(meta["width"], meta["height"]) < MIN_IMAGE_SIDE:
+                continue
+            length = _pdf_stream_length(pdf, xref)
+            if length is not None and length >= self.max_image_bytes:
+                continue
+            try:
+                blob = pdf.extract_image(xref)["image"]
+            except Exception:
+                continue
+            if len(blob) < self.max_image_bytes:
+                yield blob, meta["repeats"]
+
+
+def _clean(text: str) -> str:
+    # Схлопываем пробелы внутри строк и убираем пустые строки
+    lines = (" ".join(line.split()) for line in (text or "").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _placeholder_type(shape):
+    if not shape.is_placeholder:
+        return None
+    try:
+        return shape.placeholder_format.type
+    except ValueError:
+        return None
+
+
+def _describe_chart(chart) -> str:
+    # «Заголовок; категории: …; ряд: значения» — числа на диаграммах нужны для проверки фактов
+    parts = []
+    if chart.has_title and chart.chart_title.has_text_frame:
+        title = _clean(chart.chart_title.text_frame.text)
+        if title:
+            parts.append(title)
+    try:
+        plot = chart.plots[0]
+    except IndexError:
+        return "; ".join(parts)
+    categories = [str(category) for category in plot.categories][:MAX_CHART_POINTS]
+    if categories:
+        parts.append("категории: " + ", ".join(categories))
+    for series in plot.series:
+        values = ["" if value is None else f"{value:g}" for value in series.values]
+        tail = ", …" if len(values) > MAX_CHART_POINTS else ""
+        parts.append(f"{series.name or 'ряд'}: " + ", ".join(values[:MAX_CHART_POINTS]) + tail)
+    return "; ".join(parts)
+
+
+def _pdf_stream_length(pdf, xref: int):
+    # /Length потока изображения без его декодирования; None — если узнать не удалось
+    try:
+        kind, value = pdf.xref_get_key(xref, "Length")
+        if kind == "xref":
+            value = pdf.xref_object(int(value.split()[0]))
+        return int(value)
+    except Exception:
+        return None
@@ -0,0 +1,121 @@
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+from dataclasses import dataclass, field
+
+from scheduler import OVERLOAD_MESSAGE, OverloadedError
+
+
+# --- Фоновые задачи анализа ---
+# Анализ выполняется в пуле потоков процесса, а не в потоке скрипта Streamlit,
+# поэтому перезапуск скрипта (любой виджет, обновление страницы) его не
+# прерывает. Страница хранит только id задачи и опрашивает её состояние.
+# Завершённые задачи сохраняются в ResultCache и переживают перезапуск сервера.
+
+FINISHED_JOB_MEMORY_SECONDS = 3600  # Сколько держать завершённые задачи в памяти
+
+
+@dataclass
+class Job:
+    id: str
+    status: str = "queued"  # queued | running | done | failed
+    sections: dict = field(default_factory=dict)  # Разделы, готовые до завершения анализа
+    result: dict = None
+    error: str = None
+    submitted: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "status": self.status, "sections": self.sections, "result": self.result,
+            "error": self.error, "submitted": self.submitted, "started": self.started,
+            "finished": self.finished,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        return cls(**data)
+
+
+class JobManager:
+    def __init__(self, executor, store, max_queued: int = None):
+        self.executor = executor
+        self.store = store  # ResultCache для завершённых задач
+        self.max_queued = max_queued  # Больше задач в очереди не принимаем: OverloadedError
+        self._jobs = {}
+        self._futures = {}  # id -> Future выполняющейся или недавно завершённой задачи
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> str:
+        # fn вызывается как fn(on_section, *args, **kwargs) и должна вернуть
+        # JSON-сериализуемый словарь; on_section(key, value) копит готовые разделы
+        job = Job(id=uuid.uuid4().hex)
+        with self._lock:
+            self._prune()
+            if self.max_queued is not None and self._queued_count() >= self.max_queued:
+                raise OverloadedError(OVERLOAD_MESSAGE)
+            self._jobs[job.id] = job
+            self._futures[job.id] = self.executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def wait(self, job_id: str, timeout: float) -> bool:
+        # Ждёт завершения задачи не дольше timeout; True — задача уже не активна.
+        # Попадание в кэш завершается за доли секунды и показывается сразу, без перезапуска страницы
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            return True
+        return bool(wait([future], timeout=timeout).done)
+
+    def get(self, job_id: str):
+        # Возвращает копию состояния, чтобы страница не читала его во время записи
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return Job.from_dict({**job.to_dict(), "sections": dict(job.sections)})
+        data = self.store.get(job_id)
+        return Job.from_dict(data) if data else None
+
+    def queue_position(self, job_id: str):
+        # 1 — задача следующая на выполнение; None — уже выполняется или неизвестна
+        with self._lock:
+            queued = [job.id for job in self._jobs.values() if job.status == "queued"]
+        return queued.index(job_id) + 1 if job_id in queued else None
+
+    def _queued_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "queued")
+
+    def _run(self, job: Job, fn, args, kwargs):
+        def on_section(key, value):
+            with self._lock:
+                job.sections[key] = value
+
+        with self._lock:
+            job.status = "running"
+            job.started = time.time()
+        try:
+            result = fn(on_section, *args, **kwargs)
+            with self._lock:
+                job.result = result
+                job.status = "done"
+        except Exception as e:
+            with self._lock:
+                job.error = str(e)
+                job.status = "failed"
+        with self._lock:
+            job.finished = time.time()
+            snapshot = job.to_dict()
+        self.store.set(job.id, snapshot)
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished > FINISHED_JOB_MEMORY_SECONDS]:
+            del self._jobs[job_id]
+            self._futures.pop(job_id, None)
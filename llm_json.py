@@ -0,0 +1,161 @@
+import json
+import re
+
+
+# --- Разбор JSON-ответов модели ---
+
+class IncrementalJSONParser:
+    """Потоковый разбор JSON-объекта верхнего уровня.
+
+    feed() принимает очередной фрагмент ответа и возвращает пары (ключ, значение)
+    для полей, которые уже полностью пришли. Текст до первой «{» (и блок
+    <think>...</think> у R1) пропускается.
+    """
+
+    def __init__(self):
+        self.sections = {}
+        self.done = False
+        self._prefix = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member = []
+
+    def feed(self, chunk: str) -> list:
+        completed = []
+        for ch in chunk:
+            if self.done:
+                break
+            if not self._started:
+                self._prefix.append(ch)
+                if ch == "{":
+                    prefix = "".join(self._prefix)
+                    if "<think>" not in prefix or "</think>" in prefix:
+                        self._started = True
+                        self._depth = 1
+                continue
+            if self._in_string:
+                self._member.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+            if self._depth == 1 and ch == ",":
+                completed.extend(self._flush())
+            elif self._depth == 0:
+                completed.extend(self._flush())
+                self.done = True
+            else:
+                self._member.append(ch)
+        return completed
+
+    def _flush(self) -> list:
+        text = "".join(self._member).strip()
+        self._member = []
+        if not text:
+            return []
+        try:
+            member = json.loads("{" + text + "}")
+        except ValueError:
+            return []
+        self.sections.update(member)
+        return list(member.items())
+
+
+# --- Терпимый разбор полного ответа ---
+# R1 может начать ответ с <think>-рассуждений, обернуть JSON в ```json или
+# оборваться на max_tokens посреди массива. Вместо повторного запроса целиком
+# чиним то, что пришло: обрезаем незавершённый хвост и закрываем скобки.
+
+_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+_CODE_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+
+
+def strip_reasoning(text: str) -> str:
+    text = _THINK_BLOCK.sub("", text or "")
+    if "<think>" in text:
+        return ""  # Ответ оборвался ещё во время рассуждений
+    text = _CODE_FENCE.sub("", text)
+    start = text.find("{")
+    return text[start:] if start >= 0 else ""
+
+
+def _closers(stack: list) -> str:
+    return "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+
+def repair_json(text: str):
+    # Возвращает разобранный объект или None. Кандидаты перебираются от самого
+    # длинного: текст целиком, затем обрезки по границам завершённых значений
+    stack = []
+    cuts = []  # (позиция, открытые скобки) после завершённого значения
+    in_string = escape = False
+    for pos, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if not stack:
+                return None
+            stack.pop()
+            if not stack:
+                return _loads(text[:pos + 1])
+            cuts.append((pos + 1, list(stack)))
+        elif ch == ",":
+            cuts.append((pos, list(stack)))
+    candidates = [] if in_string else [(len(text), stack)]
+    candidates += reversed(cuts)
+    for end, open_brackets in candidates:
+        data = _loads(text[:end].rstrip().rstrip(",") + _closers(open_brackets))
+        if data is not None:
+            return data
+    return None
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def parse_model_json(text: str) -> dict:
+    # Строгий разбор, а при неудаче — починка. ValueError, если спасать нечего
+    cleaned = strip_reasoning(text)
+    data = _loads(cleaned)
+    if data is None:
+        data = repair_json(cleaned)
+    if not isinstance(data, dict):
+        raise ValueError("Ответ модели не содержит JSON-объекта")
+    return data
+
+
+def conforms(value, shape) -> bool:
+    # shape: str — непустая строка, [shape] — непустой список таких элементов,
+    # {поле: shape} — объект со всеми перечисленными полями
+    if shape is str:
+        return isinstance(value, str) and bool(value.strip())
+    if isinstance(shape, list):
+        return isinstance(value, list) and bool(value) and all(conforms(item, shape[0]) for item in value)
+    if isinstance(shape, dict):
+        return isinstance(value, dict) and all(conforms(value.get(key), sub) for key, sub in shape.items())
+    return False
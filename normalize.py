@@ -0,0 +1,106 @@
+import re
+from collections import Counter
+
+from chunking import estimate_tokens
+
+
+# --- Очистка текста от колонтитулов перед промптом ---
+# Название вуза, дата, «Стр. 3 из 40» на каждой странице — тысячи токенов на
+# длинной презентации. Строка считается колонтитулом, если повторяется на
+# многих страницах у верхнего или нижнего края (координаты блоков PyMuPDF,
+# положение фигур на слайде) или дословно почти на каждой странице. У строк
+# у края цифры при сравнении не учитываются, поэтому номера страниц тоже
+# совпадают; строки-значения («72%», «в 260 раз») не удаляются никогда — это
+# утверждения для проверки фактов. Попутно склеиваются переносы и схлопываются пробелы.
+
+EDGE_SHARE = 0.08  # Доля высоты страницы сверху и снизу, где живут колонтитулы
+MIN_REPEATS = 3
+EDGE_REPEAT_SHARE = 0.4  # У края — достаточно повтора на 40% страниц
+ANYWHERE_REPEAT_SHARE = 0.8  # Без подсказки положения — только почти на всех страницах
+MAX_BOILERPLATE_CHARS = 120  # Длинные абзацы колонтитулами не считаем, даже если повторяются
+
+_DIGITS = re.compile(r"\d+")
+_LETTERS = re.compile(r"[a-zа-яё]{2,}")
+_PAGE_NUMBER = re.compile(r"^(?:(?:стр|страница|слайд|page|slide)\.?\s*)?#(?:\s*(?:/|из|of)\s*#)?$")
+# Число с единицей («в # раз», «на #%», «# млн руб.») — значение, а не колонтитул
+_NUMERIC_VALUE = re.compile(r"^(?:[a-zа-яё]{1,3}\s+)?[^a-zа-яё]*#[^a-zа-яё]*(?:[a-zа-яё]+\.?\s*){0,2}$")
+_HYPHEN_BREAK = re.compile(r"(\w)[-\u00ad][ \t]*\n\s*(?=[a-zа-яё])")
+
+
+def line_key(line: str, mask_digits: bool = False) -> str:
+    # Цифры маскируются только для строк у края: «Стр. 3» и «Стр. 4» — один
+    # колонтитул, а «72%» и «15%» в теле слайда — разные утверждения
+    key = " ".join(line.split()).lower()
+    return _DIGITS.sub("#", key) if mask_digits else key
+
+
+def _is_footer_like(key: str) -> bool:
+    # Колонтитул — хотя бы одно слово или номер страницы; «#%» и «# раз» не колонтитулы
+    if _PAGE_NUMBER.match(key):
+        return True
+    return bool(_LETTERS.search(key)) and not _NUMERIC_VALUE.match(key)
+
+
+def join_hyphenation(text: str) -> str:
+    # «техноло-\nгия» -> «технология»; мягкие переносы внутри слов просто убираем
+    return _HYPHEN_BREAK.sub(r"\1", text).replace("\u00ad", "")
+
+
+def collapse_whitespace(text: str) -> str:
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def pdf_edge_lines(pdf_page) -> list:
+    # Строки текстовых блоков у верхнего и нижнего края страницы
+    height = pdf_page.rect.height
+    lines = []
+    for x0, y0, x1, y1, text, _, block_type in pdf_page.get_text("blocks"):
+        if block_type == 0 and (y1 <= height * EDGE_SHARE or y0 >= height * (1 - EDGE_SHARE)):
+            lines.extend(line for line in text.splitlines() if line.strip())
+    return lines
+
+
+def shape_at_edge(shape, slide_height) -> bool:
+    top, height = getattr(shape, "top", None), getattr(shape, "height", None)
+    if top is None or height is None or not slide_height:
+        return False
+    return top + height <= slide_height * EDGE_SHARE or top >= slide_height * (1 - EDGE_SHARE)
+
+
+def boilerplate_keys(pages: list) -> tuple:
+    # (ключи строк у края с маской цифр, точные строки, повторённые почти везде)
+    total = len(pages)
+    if total < MIN_REPEATS:
+        return set(), set()
+    anywhere = Counter()
+    edge = Counter()
+    for page in pages:
+        anywhere.update({line_key(line) for line in page.text.splitlines()})
+        edge.update({line_key(line, mask_digits=True) for line in page.edge_lines})
+    edge_keys = {key for key, count in edge.items()
+                 if count >= max(MIN_REPEATS, total * EDGE_REPEAT_SHARE) and _is_footer_like(key)}
+    anywhere_keys = {key for key, count in anywhere.items()
+                     if count >= max(MIN_REPEATS, total * ANYWHERE_REPEAT_SHARE)
+                     and _is_footer_like(_DIGITS.sub("#", key)) and not key.isdigit()}
+    return ({key for key in edge_keys if len(key) <= MAX_BOILERPLATE_CHARS},
+            {key for key in anywhere_keys if len(key) <= MAX_BOILERPLATE_CHARS})
+
+
+def _is_boilerplate(line: str, page_edge: set, edge_keys: set, anywhere_keys: set) -> bool:
+    masked = line_key(line, mask_digits=True)
+    return (masked in edge_keys and masked in page_edge) or line_key(line) in anywhere_keys
+
+
+def normalize_document(doc) -> int:
+    # Чистит текст страниц на месте, возвращает оценку сэкономленных токенов
+    before = estimate_tokens(doc.text)
+    for page in doc.pages:
+        page.text = collapse_whitespace(join_hyphenation(page.text))
+    edge_keys, anywhere_keys = boilerplate_keys(doc.pages)
+    if edge_keys or anywhere_keys:
+        for page in doc.pages:
+            page_edge = {line_key(line, mask_digits=True) for line in page.edge_lines}
+            page.text = "\n".join(line for line in page.text.splitlines()
+                                  if not _is_boilerplate(line, page_edge, edge_keys, anywhere_keys))
+    return max(0, before - estimate_tokens(doc.text))
@@ -0,0 +1,49 @@
+import hashlib
+
+import fitz
+
+from result_cache import make_key
+
+
+# --- Распознавание текста на сканированных страницах PDF ---
+# Страницы без текстового слоя (сканы диссертаций) распознаются локальным
+# Tesseract через PyMuPDF. Каждая страница уходит в пул процессов отдельным
+# одностраничным PDF, результат кэшируется по хэшу содержимого страницы.
+# Для Streamlit Cloud Tesseract ставится через packages.txt.
+
+OCR_LANGUAGE = "rus+eng"
+OCR_DPI = 200  # Ниже — заметно больше ошибок в кириллице, выше — медленнее без выигрыша
+MAX_OCR_PAGES = 20  # Бюджет страниц на документ
+MIN_PAGE_TEXT_CHARS = 20  # Страница с меньшим числом символов считается сканом
+OCR_PROMPT_VERSION = "1"  # Увеличивайте при смене движка или настроек распознавания
+
+
+def needs_ocr(pdf_page, text: str) -> bool:
+    return len(text.strip()) < MIN_PAGE_TEXT_CHARS and bool(pdf_page.get_images())
+
+
+def page_hash(pdf, pdf_page) -> str:
+    # Хэш потока содержимого и сырых (не декодированных) потоков изображений
+    digest = hashlib.sha1(pdf_page.read_contents())
+    for img_ref in pdf_page.get_images(full=True):
+        digest.update(pdf.xref_stream_raw(img_ref[0]) or b"")
+    return digest.hexdigest()
+
+
+def ocr_cache_key(digest: str) -> str:
+    return make_key("ocr", digest, OCR_LANGUAGE, OCR_DPI, OCR_PROMPT_VERSION)
+
+
+def single_page_pdf(pdf, page_num: int) -> bytes:
+    # В процесс передаём одну страницу, а не весь документ
+    with fitz.open() as single:
+        single.insert_pdf(pdf, from_page=page_num, to_page=page_num)
+        return single.tobytes()
+
+
+def ocr_page(data: bytes, language: str = OCR_LANGUAGE, dpi: int = OCR_DPI) -> str:
+    # Выполняется в пуле процессов
+    with fitz.open(stream=data, filetype="pdf") as pdf:
+        page = pdf[0]
+        textpage = page.get_textpage_ocr(language=language, dpi=dpi, full=True)
+        return page.get_text(textpage=textpage)
@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+# --- Разобранные документы в памяти процесса ---
+# Смена тона, правка текста доклада или повторное нажатие кнопки не должны
+# заново разбирать тот же файл. LRU по ключу содержимого загрузки, общий для
+# всех сессий (в приложении — через st.cache_resource), с бюджетом памяти:
+# при превышении вытесняются давно не использованные документы.
+
+PARSED_STORE_BYTES = 256 * 1024 * 1024
+PARSED_STORE_ENTRIES = 32
+
+
+def approx_size(doc) -> int:
+    # Грубая оценка: картинки плюс текст (str в Python — до 4 байт на символ)
+    text_size = sum(len(page.text) + len(page.notes) for page in doc.pages) * 2
+    return sum(len(blob) for blob in doc.images) + text_size
+
+
+class ParsedDocumentStore:
+    def __init__(self, max_bytes: int = PARSED_STORE_BYTES, max_entries: int = PARSED_STORE_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._items = OrderedDict()  # key -> (doc, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: str, doc):
+        size = approx_size(doc)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+            self._items[key] = (doc, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._items) > self.max_entries:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
@@ -0,0 +1,132 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# --- Поиск по фрагментам презентации (BM25) ---
+# Небольшой обратный индекс в памяти процесса: фрагменты — слайды/страницы
+# (длинные режутся окнами по словам), термы — слова, укороченные до основы.
+# По нему для каждого численного утверждения находятся несколько
+# подтверждающих фрагментов, и на проверку фактов уходят только они, с
+# номерами слайдов, а не весь текст проекта.
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+PASSAGE_WORDS = 120  # Длина окна для длинных страниц
+STEM_CHARS = 6  # Грубая основа: русские окончания короче, чем остаток слова
+TOP_PASSAGES = 3
+MAX_CLAIMS = 6
+
+_WORD = re.compile(r"[а-яёa-z0-9]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+# Число с единицей измерения, процентом или кратностью: «на 72%», «в 260 раз», «до 15 км/ч»
+_NUMERIC_CLAIM = re.compile(
+    r"\d+(?:[.,]\d+)?\s*(?:%|процент\w*|раз\w*|км|кг|м/с|т\b|тонн\w*|млн|млрд|тыс\w*|час\w*|ч\b|мин\w*|"
+    r"лет|год\w*|°|см|мм|м\b|вт|квт\w*|₽|руб\w*|\$|долл\w*)",
+    re.IGNORECASE,
+)
+
+
+def tokenize(text: str) -> list:
+    # Однобуквенные предлоги и союзы («в», «и», «с») только шумят в поиске
+    return [word[:STEM_CHARS] for word in _WORD.findall(text.lower().replace("ё", "е")) if len(word) > 1]
+
+
+@dataclass
+class Passage:
+    page: int  # Номер слайда/страницы
+    text: str
+
+
+def passages_from_pages(pages: list) -> list:
+    passages = []
+    for page in pages:
+        if not page.has_content:
+            continue
+        # Без строки «## Слайд N»: номер хранится отдельно и не должен влиять на поиск
+        body = page.serialize("pptx").split("\n", 1)[1:]
+        words = " ".join([page.title] + body).split()
+        for start in range(0, len(words), PASSAGE_WORDS):
+            passages.append(Passage(page=page.number, text=" ".join(words[start:start + PASSAGE_WORDS])))
+    return passages
+
+
+class BM25Index:
+    def __init__(self, passages: list):
+        self.passages = passages
+        self._vocabulary = {}
+        postings = {}  # term_id -> ([номера фрагментов], [частоты])
+        lengths = []
+        for doc_id, passage in enumerate(passages):
+            terms = Counter(tokenize(passage.text))
+            lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                term_id = self._vocabulary.setdefault(term, len(self._vocabulary))
+                docs, tfs = postings.setdefault(term_id, ([], []))
+                docs.append(doc_id)
+                tfs.append(tf)
+        self._lengths = np.asarray(lengths, dtype=np.float64)
+        average = self._lengths.mean() if len(lengths) else 0.0
+        # Нормировка длины считается один раз для всех фрагментов
+        self._norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths / (average or 1.0))
+        self._postings = {
+            term_id: (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float64))
+            for term_id, (docs, tfs) in postings.items()
+        }
+        n = len(passages)
+        self._idf = {
+            term_id: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term_id, (docs, _) in self._postings.items()
+        }
+
+    def search(self, query: str, k: int = TOP_PASSAGES) -> list:
+        # [(фрагмент, оценка)] по убыванию оценки, только с ненулевой оценкой
+        scores = np.zeros(len(self.passages))
+        for term in set(tokenize(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            docs, tfs = self._postings[term_id]
+            scores[docs] += self._idf[term_id] * tfs * (BM25_K1 + 1) / (tfs + self._norm[docs])
+        if not scores.any():
+            return []
+        top = np.argsort(-scores)[:k]
+        return [(self.passages[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+def find_numeric_claims(pages: list, limit: int = MAX_CLAIMS) -> list:
+    # [(номер страницы, предложение)] с числами и единицами, без повторов
+    claims = []
+    seen = set()
+    for page in pages:
+        body = "\n".join(filter(None, [page.title, page.text, page.notes]))
+        for sentence in _SENTENCE_END.split(body):
+            sentence = " ".join(sentence.split())
+            if len(sentence) < 15 or not _NUMERIC_CLAIM.search(sentence):
+                continue
+            normalized = " ".join(tokenize(sentence))
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+            claims.append((page.number, sentence))
+            if len(claims) >= limit:
+                return claims
+    return claims
+
+
+def collect_evidence(pages: list, limit: int = MAX_CLAIMS, k: int = TOP_PASSAGES) -> list:
+    # [(утверждение, [(номер слайда, фрагмент)])] для запроса проверки фактов
+    claims = find_numeric_claims(pages, limit)
+    if not claims:
+        return []
+    index = BM25Index(passages_from_pages(pages))
+    evidence = []
+    for page, claim in claims:
+        found = [(passage.page, passage.text) for passage, _ in index.search(claim, k)]
+        if not any(number == page for number, _ in found):
+            found.insert(0, (page, claim))  # Слайд, где утверждение прозвучало, — всегда в выборке
+        evidence.append((claim, found))
+    return evidence
@@ -0,0 +1,431 @@
+import time
+from concurrent.futures import wait
+from dataclasses import dataclass, field
+
+from analysis import (ANALYSIS_MODEL, ANALYSIS_SECTIONS, CAPTION_MODEL, CAPTION_PROMPT_VERSION, CORE_PROMPT_VERSION,
+                      FACT_CHECK_PROMPT_VERSION, GROUNDED_CORE_PROMPT_VERSION, GROUNDED_PROMPT_VERSION, PROMPT_VERSION,
+                      SECTION_PROMPT_VERSION, STORY_PROMPT_VERSION, TONES, without_fact_check,
+                      caption_images, condense_project_text, get_analysis_from_deepseek, get_core_analysis,
+                      get_delta_analysis, get_grounded_fact_check, get_sectioned_analysis, get_storytelling,
+                      stream_analysis_from_deepseek)
+from image_dedup import select_distinct_images
+from ingest import DocumentIngestor
+from passage_index import collect_evidence
+from result_cache import make_key
+from revisions import diff_revision, save_revision
+from scheduler import OverloadedError
+from telemetry import METRICS
+from uploads import content_hash
+from vision import batched
+
+
+# --- Оркестрация этапов анализа ---
+# Подписи к изображениям запускаются на общем пуле потоков, как только разбор
+# файла собрал изображения (до OCR и нормализации текста), и считаются, пока
+# идут распознавание сканов, проверка фактов по слайдам, сверка с прошлой
+# версией и сжатие длинного текста. Анализ ждёт подписи и получает их вместе
+# с текстом: они идут после текста проекта, чтобы префикс промпта с текстом
+# оставался общим для повторных запусков.
+
+# Из файла берём до 24 разных картинок, а подписываем 3 самых информативных
+MAX_IMAGE_CANDIDATES = 24
+MAX_CAPTIONED_IMAGES = 3
+
+STAGE_LABELS = {
+    "parse": "Разбор файла",
+    "reuse": "Файл из памяти",
+    "ocr": "Распознавание сканов",
+    "select_images": "Отбор изображений",
+    "captions": "Подписи к изображениям",
+    "condense": "Сжатие длинного текста",
+    "delta": "Анализ изменений",
+    "fact_check": "Проверка фактов по слайдам",
+    "first_section": "Первый раздел",
+    "analysis": "Анализ ИИ",
+    "total": "Всего",
+}
+
+
+@dataclass
+class PipelineResult:
+    parsed: object = None
+    image_descriptions: str = ""
+    cached_captions: int = 0
+    analysis: dict = None
+    from_cache: bool = False
+    parsed_from_memory: bool = False  # Файл уже был разобран (смена тона, повторный запуск)
+    empty_input: bool = False
+    revision: dict = None  # Повторная проверка: сколько страниц изменено, удалено, всего
+    tokens_saved: int = 0  # Убрано колонтитулов и прочих повторов (normalize.py)
+    errors: list = field(default_factory=list)
+    timings: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        # Всё, кроме разобранного документа: для хранения и отображения результата
+        return {
+            "image_descriptions": self.image_descriptions,
+            "cached_captions": self.cached_captions,
+            "analysis": self.analysis,
+            "from_cache": self.from_cache,
+            "parsed_from_memory": self.parsed_from_memory,
+            "empty_input": self.empty_input,
+            "revision": self.revision,
+            "tokens_saved": self.tokens_saved,
+            "errors": self.errors,
+            "timings": self.timings,
+        }
+
+
+def analysis_cache_key(project_text: str, tone: str, prompt_version: str = PROMPT_VERSION) -> str:
+    # Нормализуем пробелы, чтобы косметические отличия текста не сбивали кэш
+    normalized = " ".join(project_text.split())
+    return make_key(normalized, tone, ANALYSIS_MODEL, prompt_version)
+
+
+def get_cached_analysis(client, cache, project_text: str, tone: str, regenerate: bool = False,
+                        on_section=None, executor=None, sectioned: bool = False, timings=None, revision=None,
+                        all_tones: bool = False, grounded_facts: bool = False, prepared_text: str = None):
+    # grounded_facts — проверка фактов идёт отдельным запросом по фрагментам слайдов
+    # (grounded_fact_check), и основной запрос в любом режиме её не генерирует.
+    # prepared_text — тот же текст, уже сжатый вызывающим; ключ кэша всё равно по project_text
+    if all_tones:
+        return get_all_tones_analysis(client, cache, project_text, tone, regenerate, on_section, executor, timings,
+                                      grounded_facts, prepared_text)
+    sections = without_fact_check(ANALYSIS_SECTIONS, grounded_facts)
+    prompt_version = GROUNDED_PROMPT_VERSION if grounded_facts else PROMPT_VERSION
+    if sectioned:
+        prompt_version = f"{SECTION_PROMPT_VERSION}-grounded" if grounded_facts else SECTION_PROMPT_VERSION
+    key = analysis_cache_key(project_text, tone, prompt_version)
+    if not regenerate:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, True
+    if revision is not None:
+        # Исправленная версия уже проверенной презентации: отправляем только изменения
+        start_time = time.perf_counter()
+        try:
+            result = get_delta_analysis(client, revision.previous_analysis, revision.changed_text(),
+                                        revision.removed, tone, grounded_facts)
+        except Exception:
+            result = None  # Не получилось — делаем полный анализ ниже
+        if timings is not None:
+            timings["delta"] = time.perf_counter() - start_time
+        if result:
+            if on_section:
+                for section in ANALYSIS_SECTIONS:
+                    if section in result:
+                        on_section(section, result[section])
+            # "changes" — сравнение с версией этого владельца; в общий кэш не попадает,
+            # иначе другая сессия увидит изменения относительно чужой прошлой версии
+            cache.set(key, {section: value for section, value in result.items() if section != "changes"})
+            return result, False
+    # Длинный документ сначала сжимаем map-reduce суммаризацией, а не обрезаем
+    project_text = _condense(client, executor, cache, prepared_text or project_text, timings)
+    if sectioned:
+        result = get_sectioned_analysis(client, executor, project_text, tone, on_section, sections)
+    elif on_section:
+        result = stream_analysis_from_deepseek(client, project_text, tone, on_section, grounded_facts)
+    else:
+        result = get_analysis_from_deepseek(client, project_text, tone, grounded_facts)
+    # Частичный результат (часть разделов не получена) не кэшируем
+    if result and "section_errors" not in result:
+        cache.set(key, result)
+    return result, False
+
+
+def _condense(client, executor, cache, project_text: str, timings) -> str:
+    start_time = time.perf_counter()
+    condensed_text = condense_project_text(client, executor, project_text, cache)
+    if condensed_text is not project_text and timings is not None:
+        # Сжатие могло начаться раньше, пока считались подписи: время складываем
+        timings["condense"] = timings.get("condense", 0) + time.perf_counter() - start_time
+    return condensed_text
+
+
+def _cached_story(client, cache, key: str, project_text: str, tone: str):
+    story = get_storytelling(client, project_text, tone)
+    cache.set(key, story)
+    return story
+
+
+def get_all_tones_analysis(client, cache, project_text: str, tone: str, regenerate: bool = False,
+                           on_section=None, executor=None, timings=None, grounded: bool = False,
+                           prepared_text: str = None):
+    # Общие для всех тонов разделы считаются и кэшируются один раз, сценарии
+    # выступления для всех тонов — параллельно и каждый под своим ключом.
+    # Ждём только общие разделы и сценарий выбранного тона: остальные
+    # досчитываются на пуле, и переключение тона потом берёт их из кэша
+    core_key = analysis_cache_key(project_text, "", GROUNDED_CORE_PROMPT_VERSION if grounded else CORE_PROMPT_VERSION)
+    story_keys = {option: analysis_cache_key(project_text, option, STORY_PROMPT_VERSION) for option in TONES}
+    story_keys.setdefault(tone, analysis_cache_key(project_text, tone, STORY_PROMPT_VERSION))
+    core = None if regenerate else cache.get(core_key)
+    stories = {option: None if regenerate else cache.get(key) for option, key in story_keys.items()}
+    if core is not None and stories[tone] is not None:
+        result = {**core, "storytelling_script": stories[tone]}
+        if on_section:
+            for key in ANALYSIS_SECTIONS:
+                if key in result:
+                    on_section(key, result[key])
+        return result, True
+
+    project_text = _condense(client, executor, cache, prepared_text or project_text, timings)
+    story_futures = {option: executor.submit(_cached_story, client, cache, story_keys[option], project_text, option)
+                     for option, story in stories.items() if story is None}
+    if core is None:
+        core = get_core_analysis(client, project_text, on_section, grounded)
+        if core and "section_errors" not in core:
+            cache.set(core_key, core)
+    elif on_section:
+        for key, value in core.items():
+            if key != "section_errors":
+                on_section(key, value)
+    result = dict(core or {})
+    try:
+        story = stories[tone] if stories[tone] is not None else story_futures[tone].result()
+    except Exception as e:
+        result.setdefault("section_errors", {})["storytelling_script"] = str(e)
+    else:
+        result["storytelling_script"] = story
+        if on_section:
+            on_section("storytelling_script", story)
+    if not any(key in result for key in ANALYSIS_SECTIONS):
+        raise RuntimeError("; ".join(result.get("section_errors", {}).values()) or "Не удалось получить анализ")
+    return result, False
+
+
+def fact_check_cache_key(evidence: list) -> str:
+    return make_key("fact_check", evidence, ANALYSIS_MODEL, FACT_CHECK_PROMPT_VERSION)
+
+
+def grounded_fact_check(client, cache, evidence: list, regenerate: bool = False):
+    # Ключ — сами утверждения и фрагменты: правка несвязанного слайда не сбивает кэш
+    key = fact_check_cache_key(evidence)
+    if not regenerate:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    fact_check = get_grounded_fact_check(client, evidence)
+    cache.set(key, fact_check)
+    return fact_check
+
+
+def _merge_fact_check(result, future, on_section):
+    # При найденных утверждениях основной анализ fact_check не генерирует — раздел
+    # приходит отсюда; если проверка не удалась, а раздела нет — ошибка раздела
+    try:
+        fact_check, result.timings["fact_check"] = future.result()
+    except Exception as e:
+        if result.analysis is not None and "fact_check" not in result.analysis:
+            result.analysis.setdefault("section_errors", {})["fact_check"] = str(e)
+        return
+    if result.analysis is None:
+        return
+    result.analysis["fact_check"] = fact_check
+    if on_section:
+        on_section("fact_check", fact_check)
+
+
+def caption_cache_key(image_hash: str) -> str:
+    return make_key("caption", image_hash, CAPTION_MODEL, CAPTION_PROMPT_VERSION)
+
+
+@dataclass
+class CaptionJob:
+    descriptions: list  # По отобранным изображениям: подпись или None, пока не готова
+    futures: list  # [(позиции в descriptions, Future пачки)]
+    cached: int = 0
+    select_seconds: float = 0.0
+
+
+def start_captions(client, executor, cache, parsed) -> CaptionJob:
+    # Отбор изображений и пачки подписей на пул; из кэша подписи берутся сразу
+    start_time = time.perf_counter()
+    if parsed.selected_images is None:
+        parsed.selected_images = select_distinct_images(parsed.images, parsed.image_repeats, MAX_CAPTIONED_IMAGES)
+    selected = parsed.selected_images
+    descriptions = [cache.get(caption_cache_key(image_hash)) for _, image_hash in selected]
+    pending = [i for i, description in enumerate(descriptions) if not description]
+    select_seconds = time.perf_counter() - start_time
+    futures = [(positions, executor.submit(_timed, _caption_batch, client, cache, [selected[i] for i in positions]))
+               for positions in batched(pending)]
+    return CaptionJob(descriptions=descriptions, futures=futures, cached=len(selected) - len(pending),
+                      select_seconds=select_seconds)
+
+
+def _caption_batch(client, cache, batch: list) -> list:
+    # batch — пары (изображение, pHash); удачные подписи сохраняем по pHash,
+    # чтобы тот же логотип или картинка из другой презентации не ушли в API повторно
+    descriptions = caption_images(client, [img_data for img_data, _ in batch])
+    for (_, image_hash), description in zip(batch, descriptions):
+        if description:
+            cache.set(caption_cache_key(image_hash), description)
+    return descriptions
+
+
+def _timed(func, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def parsed_store_key(uploaded_file, upload_hash: str) -> str:
+    # Имя файла входит в ключ: по нему ищется прошлая версия (revisions.py)
+    return make_key("parsed", upload_hash, uploaded_file.name, MAX_IMAGE_CANDIDATES)
+
+
+def run_pipeline(client, executor, cache, uploaded_file, report_text: str, tone: str,
+                 regenerate: bool = False, on_section=None, sectioned: bool = False,
+                 ocr_pool=None, parsed_store=None, all_tones: bool = False,
+                 revision_owner: str = None) -> PipelineResult:
+    # on_section(key, value) включает потоковый режим: разделы отдаются по мере готовности,
+    # sectioned — анализ отдельными параллельными запросами на каждый раздел,
+    # all_tones — общие разделы один раз и сценарии сразу для всех тонов,
+    # ocr_pool — пул процессов для распознавания сканированных страниц PDF,
+    # parsed_store — ParsedDocumentStore: тот же файл второй раз не разбирается,
+    # revision_owner — чьи прошлые версии файла искать (без него версии не сравниваются)
+    pipeline_start = time.perf_counter()
+    parsed = None
+    timings = {}
+    parsed_from_memory = False
+    captions = None
+    if uploaded_file is not None:
+        store_key = parsed_store_key(uploaded_file, content_hash(uploaded_file)) if parsed_store else None
+        parsed = parsed_store.get(store_key) if store_key else None
+        if parsed is not None:
+            parsed_from_memory = True
+            timings["reuse"] = time.perf_counter() - pipeline_start
+        else:
+            def on_images(doc):
+                # Подписи стартуют, пока разбор ещё распознаёт сканы и чистит текст
+                nonlocal captions
+                if client and doc.images:
+                    captions = start_captions(client, executor, cache, doc)
+
+            parsed = DocumentIngestor(max_images=MAX_IMAGE_CANDIDATES, ocr_pool=ocr_pool,
+                                      ocr_cache=cache).ingest_upload(uploaded_file, on_images)
+            timings["parse"] = time.perf_counter() - pipeline_start
+            if "ocr" in parsed.timings:
+                timings["ocr"] = parsed.timings["ocr"]
+            METRICS.increment("normalize_tokens_saved_total", parsed.tokens_saved, kind=parsed.kind)
+            if store_key and not parsed.errors:
+                parsed_store.put(store_key, parsed)
+    result = analyze_document(client, executor, cache, parsed, report_text, tone, regenerate=regenerate,
+                              on_section=on_section, sectioned=sectioned, timings=timings, all_tones=all_tones,
+                              revision_owner=revision_owner, captions=captions)
+    result.parsed_from_memory = parsed_from_memory
+    result.timings["total"] = time.perf_counter() - pipeline_start
+    return result
+
+
+def analyze_document(client, executor, cache, parsed, report_text: str, tone: str,
+                     regenerate: bool = False, on_section=None, sectioned: bool = False,
+                     timings: dict = None, all_tones: bool = False, revision_owner: str = None,
+                     captions: CaptionJob = None) -> PipelineResult:
+    # Всё после разбора файла: подписи, сжатие и анализ. parsed — ParsedDocument
+    # или None, если загружен только текст доклада; captions — подписи, уже
+    # запущенные во время разбора (run_pipeline)
+    result = PipelineResult(parsed=parsed, timings=dict(timings or {}))
+    analysis_pipeline_start = time.perf_counter()
+
+    project_text = ""
+    descriptions = []
+    caption_futures = []
+    fact_future = None
+    if parsed is not None:
+        result.errors.extend(parsed.errors)
+        result.tokens_saved = parsed.tokens_saved
+        project_text = parsed.text
+        if client:
+            # Численные утверждения проверяются отдельным небольшим запросом
+            # параллельно с анализом: в нём только найденные фрагменты слайдов
+            if parsed.fact_evidence is None:
+                parsed.fact_evidence = collect_evidence(parsed.pages)
+            if parsed.fact_evidence:
+                fact_future = executor.submit(_timed, grounded_fact_check, client, cache,
+                                              parsed.fact_evidence, regenerate)
+        if client and parsed.images:
+            if captions is None:
+                captions = start_captions(client, executor, cache, parsed)
+            descriptions = captions.descriptions
+            caption_futures = captions.futures
+            result.cached_captions = captions.cached
+            result.timings["select_images"] = captions.select_seconds
+
+    def collect_captions():
+        wait([future for _, future in caption_futures])
+        durations = []
+        for positions, future in caption_futures:
+            batch_descriptions, duration = future.result()
+            durations.append(duration)
+            for i, description in zip(positions, batch_descriptions):
+                descriptions[i] = description
+        result.image_descriptions = "\n".join(
+            f"Изображение #{idx}: {description or 'Ошибка обработки'}"
+            for idx, description in enumerate(descriptions, start=1)
+        )
+        if durations:
+            # Пачки подписей идут параллельно, поэтому этап длится столько, сколько самая долгая
+            result.timings["captions"] = max(durations)
+
+    revision = None
+    if parsed is not None and revision_owner and client and not regenerate and not all_tones:
+        revision = diff_revision(cache, revision_owner, parsed, tone, report_text)
+        if revision is not None:
+            result.revision = revision.summary()
+
+    condensed_text = None
+    if caption_futures and revision is None and not all(future.done() for _, future in caption_futures):
+        # Пока подписи в работе, сжимаем длинный текст проекта, а подписи
+        # добавляем уже к сжатому: анализ не ждёт подписи и сжатие по очереди
+        try:
+            condensed_text = _condense(client, executor, cache, project_text, result.timings)
+        except Exception:
+            pass  # Не вышло — сожмём текст вместе с подписями при анализе
+    collect_captions()
+    # Неудачные подписи в промпт не идут: «Ошибка обработки» модели ничего не скажет
+    caption_text = "\n".join(f"Изображение #{idx}: {description}"
+                             for idx, description in enumerate(descriptions, start=1) if description)
+
+    def with_captions(text):
+        return "".join(filter(None, [text, caption_text and f"\n\n{caption_text}\n\n", report_text]))
+
+    combined_text = with_captions(project_text)
+    prepared_text = with_captions(condensed_text) if condensed_text not in (None, project_text) else None
+
+    result.empty_input = not combined_text.strip()
+    if not result.empty_input:
+        section_callback = None
+        if on_section:
+            analysis_start = time.perf_counter()
+
+            def section_callback(key, value):
+                result.timings.setdefault("first_section", time.perf_counter() - analysis_start)
+                on_section(key, value)
+
+        try:
+            (result.analysis, result.from_cache), result.timings["analysis"] = _timed(
+                get_cached_analysis, client, cache, combined_text, tone, regenerate,
+                on_section=section_callback, executor=executor, sectioned=sectioned,
+                timings=result.timings, revision=revision, all_tones=all_tones,
+                grounded_facts=fact_future is not None, prepared_text=prepared_text
+            )
+        except OverloadedError as e:
+            result.errors.append(str(e))
+        except Exception as e:
+            result.errors.append(f"Ошибка при вызове API: {e}")
+        if fact_future is not None:
+            _merge_fact_check(result, fact_future, section_callback)
+        if (result.analysis and "section_errors" not in result.analysis and parsed is not None and parsed.source
+                and revision_owner):
+            save_revision(cache, revision_owner, parsed, tone, report_text, result.analysis)
+
+    result.timings["total"] = result.timings.get("parse", 0) + time.perf_counter() - analysis_pipeline_start
+    if not result.empty_input:
+        METRICS.record_pipeline(result.timings, result.from_cache, result.cached_captions, len(descriptions))
+    return result
+
+
+def format_timings(timings: dict) -> str:
+    return " · ".join(
+        f"{label}: {timings[stage]:.1f} сек" for stage, label in STAGE_LABELS.items() if stage in timings
+    )
@@ -1,13 +1,19 @@
 import streamlit as st
-from openai import OpenAI
 import json
-from pptx import Presentation
-import io
-import fitz
-import base64
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import os
 import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from analysis import ANALYSIS_SECTIONS, TONES, make_client
+from jobs import JobManager
+from parsed_store import ParsedDocumentStore
+from pipeline import format_timings, run_pipeline
+from prompts import EXAMPLE_STORYTELLING_TEXT
+from result_cache import ResultCache
+from scheduler import MAX_QUEUED_JOBS, FairExecutor, FairScheduler, OverloadedError, ScheduledClient
+from telemetry import METRICS
+from uploads import UploadTooLargeError, spool_upload
 
 # --- Начальная настройка ---
 st.set_page_config(
@@ -16,76 +22,11 @@ st.set_page_config(
     layout="wide"
 )
 
-EXAMPLE_STORYTELLING_TEXT = """Добрый день, уважаемые коллеги, эксперты, партнёры.
-Сегодня мы представляем проект, который находится на пересечении технологий будущего, устойчивого развития и новой философии взаимодействия с мировым океаном.
-Проект «Спрут» — это не просто прототип. Это шаг в сторону цивилизованной, экологичной и высокотехнологичной добычи донных полиметаллических конкреций.
-Почему это важно?
-Полиметаллические конкреции — это настоящие сокровища океанского дна.
-Они содержат стратегически важные металлы: марганец, никель, кобальт, медь — именно те, что лежат в основе «зелёной» энергетики, аккумуляторов, микроэлектроники и электротранспорта.
-На дне океанов этих ресурсов в 3–4 раза больше, чем на всей суше.
-Общие запасы — более 500 миллиардов тонн, из которых половина — полезные минералы.
-Это колоссальный потенциал, который может обеспечить человечество сырьём на десятилетия вперёд.
-Но есть проблема.
-Современные методы добычи устарели и наносят катастрофический урон экосистемам.
-При работе тяжёлых драг гибнет более 51% микроорганизмов. Разрушаются биосообщества, нарушается устойчивость экосистем.
-При этом спрос на океанические ресурсы не просто растёт — он взрывается.
-Количество лицензий на добычу в России с 2020 по 2024 год выросло на 200%.
-А мировой рынок подводных технологий демонстрирует рост на 43% в год.
-Что мы предложили
-Наша задача: создать технологию, которая не разрушает — а бережно взаимодействует с природой.
-Изучив существующие решения, проанализировав патенты и собрав межрегиональную команду инженеров, мы разработали принципиально новый подход к подводной добыче.
-Так родился «Спрут».
-Что такое «Спрут»?
-Это мобильная автономная платформа с биомиметическим манипулятором, вдохновлённым природой — щупальцами осьминога и хоботом слона.
-Ключевые особенности:
-Манипулятор построен по логарифмической спирали — он способен работать с объектами различной формы и диаметра.
-Поднимает предметы в 260 раз тяжелее собственного веса.
-Управление — как в ручном режиме через приложение, так и в автономном.
-Встроенное машинное зрение определяет и классифицирует конкреции прямо на дне.
-Что уже сделано
-Мы прошли ключевые этапы:
-Исследования и патентный анализ
-Создание 3D-моделей, разработка электронных компонентов
-Сборка и настройка первого прототипа
-Первичные испытания в лабораторных условиях
-Сегодня у нас — действующий макет манипулятора, рабочая платформа, система управления и программное обеспечение.
-Что изменится?
-Сравнив нашу систему с традиционными методами, мы получили:
-Снижение повреждений донного грунта на 72%
-Подъём одной конкреции — за 10 секунд
-Скорость передвижения платформы — до 15 км/ч
-Автономная работа — до 1,8 часов на одной зарядке
-Платформа адаптируется к различным морфологиям дна — мы разработали три её конфигурации.
-Кому это выгодно?
-Государству — развитие технологического суверенитета и снижение зависимости от импорта
-Бизнесу — экологичный имидж, снижение штрафных рисков, экспортный потенциал
-Учёным — этичный инструмент для глубоководных исследований
-Природе — потому что мы не нарушаем её, а работаем в гармонии с ней
-Кто мы?
-Мы — команда из 9 инженеров, программистов и схемотехников из разных регионов России.
-Нас объединяет страсть к подводной робототехнике и желание переопределить правила в отрасли.
-Что дальше?
-Проект готов к следующему шагу — испытаниям в реальных морских условиях.
-Нам необходимо:
-Провести испытания в открытой воде
-Дооснастить платформу системой связи и стабилизации
-Найти партнёра для запуска пилотного промышленного контракта
-Финал
-«Спрут» — это не просто машина. Это философия.
-Философия бережного, уважительного и умного освоения океана.
-Мы верим, что технологии должны быть союзниками природы — а не её врагами.
-И если океан — это последнее великое неизведанное пространство на Земле,
-мы готовы идти туда. Но идти иначе. С умом, с уважением — и с инновациями.
-Спасибо за внимание.
-"""
-
 @st.cache_resource
 def get_openai_client():
+    # Один клиент на процесс: его ограничитель скорости и предохранитель общие для всех сессий
     try:
-        client = OpenAI(
-            api_key=st.secrets["DEEPSEEK_API_KEY"],
-            base_url="https://api.studio.nebius.ai/v1/"
-        )
+        client = make_client(st.secrets["DEEPSEEK_API_KEY"])
         return client
     except Exception as e:
         st.error(f"Ошибка при инициализации клиента API: {e}")
@@ -93,149 +34,194 @@ def get_openai_client():
 
 client = get_openai_client()
 
-# --- Оптимизированные функции извлечения ---
-def extract_text_from_pptx(uploaded_file):
-    try:
-        pptx_buffer = io.BytesIO(uploaded_file.getvalue())
-        prs = Presentation(pptx_buffer)
-        text_runs = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if not shape.has_text_frame:
-                    continue
-                for paragraph in shape.text_frame.paragraphs:
-                    for run in paragraph.runs:
-                        text_runs.append(run.text)
-        return "\n".join(text_runs)
-    except Exception as e:
-        st.error(f"Ошибка при чтении файла презентации: {e}")
-        return ""
+@st.cache_resource
+def get_analysis_cache():
+    return ResultCache(table="analysis")
 
-def extract_images_from_pptx(uploaded_file):
-    images = []
-    try:
-        pptx_buffer = io.BytesIO(uploaded_file.getvalue())
-        prs = Presentation(pptx_buffer)
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, 'shape_type') and shape.shape_type == 13:  # Picture type
-                    if hasattr(shape, 'image'):
-                        img = shape.image
-                        # Ограничиваем размер изображения для ускорения обработки
-                        if len(img.blob) < 500000:  # Только изображения меньше 500KB
-                            images.append(img.blob)
-    except Exception as e:
-        st.error(f"Ошибка при извлечении изображений из презентации: {e}")
-    return images[:3]  # Ограничиваем до 3 изображений
+@st.cache_resource
+def get_scheduler():
+    # Лимиты одновременных запросов к каждой модели и очередь по сессиям — на весь процесс
+    return FairScheduler()
+
+@st.cache_resource
+def get_executor():
+    # Общий пул потоков на процесс вместо отдельного пула на каждый запуск.
+    # Потоки раздаются сессиям по кругу, число запросов к моделям ограничивает
+    # get_scheduler(); потоков с запасом, чтобы ждущие модели не занимали все
+    return FairExecutor(ThreadPoolExecutor(max_workers=32, thread_name_prefix="pipeline"), max_workers=32)
+
+@st.cache_resource
+def get_parsed_store():
+    # Разобранные файлы общие для всех сессий: смена тона не разбирает файл заново
+    return ParsedDocumentStore()
+
+@st.cache_resource
+def get_ocr_pool():
+    # Распознавание сканов упирается в CPU: отдельные процессы на все ядра.
+    # spawn, а не fork — процесс Streamlit многопоточный
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 2, mp_context=get_context("spawn"))
 
-def extract_images_from_pdf(uploaded_file):
-    images = []
+@st.cache_resource
+def get_job_manager():
+    # Отдельный пул для самих задач: их подзадачи (подписи, разделы) идут в get_executor()
+    return JobManager(ThreadPoolExecutor(max_workers=16, thread_name_prefix="job"),
+                      ResultCache(table="jobs", ttl_seconds=24 * 3600), max_queued=MAX_QUEUED_JOBS)
+
+JOB_POLL_SECONDS = 1.0
+JOB_FAST_PATH_SECONDS = 0.3  # Столько ждём задачу сразу после запуска: результат из кэша — без «⏳» и перезапуска
+
+def analysis_job(on_section, client, executor, cache, ocr_pool, parsed_store, upload, report_text, tone,
+                 regenerate, stream, sectioned, all_tones, session_id):
+    # Выполняется в фоновом потоке: никаких вызовов st.* здесь быть не должно
     try:
-        pdf_bytes = uploaded_file.getvalue()
-        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-            for page_num, page in enumerate(doc):
-                if page_num > 5:  # Ограничиваем до 5 страниц
-                    break
-                for img_ref in page.get_images(full=True):
-                    xref = img_ref[0]
-                    base_image = doc.extract_image(xref)
-                    # Ограничиваем размер изображения
-                    if len(base_image["image"]) < 500000:
-                        images.append(base_image["image"])
-    except Exception as e:
-        st.error(f"Ошибка при извлечении изображений из PDF: {e}")
-    return images[:3]  # Ограничиваем до 3 изображений
-
-def recognize_images(images: list) -> str:
-    descriptions = []
-    if not client or not images:
-        return ""
-    
-    # Параллельная обработка изображений
-    def process_single_image(img_data, idx):
-        try:
-            b64 = base64.b64encode(img_data).decode('utf-8')
-            # Ограничиваем размер base64 строки
-            if len(b64) > 15000:
-                b64 = b64[:15000]
-                note = " (усечено)"
+        run = run_pipeline(client, executor, cache, upload, report_text, tone,
+                           regenerate=regenerate, on_section=on_section if stream else None,
+                           sectioned=sectioned, ocr_pool=ocr_pool, parsed_store=parsed_store,
+                           all_tones=all_tones, revision_owner=session_id)
+    finally:
+        if upload is not None:
+            upload.close()  # Удаляем временный файл загрузки
+    return run.to_dict()
+
+# --- Отображение результатов ---
+def render_strengths(strengths):
+    st.write("**Сильные стороны:**")
+    if isinstance(strengths, list):
+        for strength in strengths:
+            st.success(f"✅ {strength}")
+    else:
+        st.success(f"✅ {strengths}")
+
+def render_weaknesses(weaknesses):
+    st.write("**Для улучшения:**")
+    if isinstance(weaknesses, list):
+        for weakness in weaknesses:
+            st.warning(f"⚠️ {weakness}")
+    else:
+        st.warning(f"⚠️ {weaknesses}")
+
+def render_fact_check(fact_checks):
+    st.write("**Проверка фактов:**")
+    if isinstance(fact_checks, list):
+        for fact in fact_checks:
+            if isinstance(fact, dict):
+                claim = fact.get('claim', '')
+                verdict = fact.get('verdict', '')
+                explanation = fact.get('explanation', '')
+                with st.expander(f"**{claim}**"):
+                    st.write(f"**Вердикт:** {verdict}")
+                    st.write(f"**Объяснение:** {explanation}")
+                    if fact.get('slides'):
+                        st.caption("Слайды: " + ", ".join(str(page) for page in fact['slides']))
             else:
-                note = ""
-            
-            prompt = f"Кратко опишите, что изображено на изображении #{idx}{note}."
-            
-            response = client.chat.completions.create(
-                model="google/gemma-3-27b-it",  # Используем указанную модель
-                max_tokens=150,  # Увеличено для лучшего качества
-                temperature=0.3,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return f"Изображение #{idx}: {response.choices[0].message.content.strip()}"
-        except Exception as e:
-            return f"Изображение #{idx}: Ошибка обработки"
-    
-    # Используем ThreadPoolExecutor для параллельной обработки
-    with ThreadPoolExecutor(max_workers=2) as executor:  # Уменьшено до 2 потоков
-        futures = [executor.submit(process_single_image, img_bytes, idx) 
-                  for idx, img_bytes in enumerate(images[:3], start=1)]
-        descriptions = [future.result() for future in futures]
-    
-    return "\n".join(descriptions)
-
-def extract_text_from_pdf(uploaded_file):
-    try:
-        pdf_bytes = uploaded_file.getvalue()
-        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-            # Ограничиваем количество страниц для обработки
-            pages_to_process = min(10, len(doc))  # Максимум 10 страниц
-            return "\n".join([doc[i].get_text() for i in range(pages_to_process)])
-    except Exception as e:
-        st.error(f"Ошибка при чтении PDF-файла: {e}")
-        return ""
+                st.write(f"**Факт:** {fact}")
+    else:
+        st.write(f"**Факты:** {fact_checks}")
 
-def get_analysis_from_deepseek(project_text: str, tone: str):
-    if not client:
-        return None
+def render_storytelling_script(script):
+    st.write("**Сценарий выступления:**")
 
-    # Ограничиваем длину текста для ускорения обработки
-    if len(project_text) > 20000:
-        project_text = project_text[:20000] + "\n... (текст усечен для ускорения обработки)"
+    # Проверяем тип данных script
+    if isinstance(script, str):
+        # Если это строка, пытаемся преобразовать в JSON
+        try:
+            script = json.loads(script)
+        except:
+            st.write(script)
+            script = {}
 
-    storytelling_instruction = f"""
-Создайте захватывающий сценарий выступления в стиле {tone.lower()} TED с чётким разделением на три части:
-1. "introduction": мощное вступление — обозначьте проблему и представьте название проекта
-2. "main_part": развернутая основная часть — опишите цель, ход работы и ключевую новизну проекта, укажи основные элементы детали.
-3. "conclusion": убедительное заключение — подведите итоги и подчеркните значимость результатов
+    if isinstance(script, dict):
+        sections = [
+            ("🎯 Вступление", "introduction"),
+            ("📝 Основная часть", "main_part"), 
+            ("🏁 Заключение", "conclusion")
+        ]
+        for title, key in sections:
+            content = script.get(key, "")
+            if content:
+                with st.expander(title, expanded=len(content) < 300):
+                    st.write(content)
+    else:
+        st.write("Сценарий:", script)
 
-(Стиль: живой, конкретный, без абстракций)
-Выдай текст схожий по размеру и каечству как тут: {EXAMPLE_STORYTELLING_TEXT}
-"""
+def render_tricky_questions(questions):
+    st.write("**Каверзные вопросы:**")
+    if isinstance(questions, list):
+        for i, question in enumerate(questions, 1):
+            st.info(f"{i}. {question}")
+    else:
+        st.info(f"Вопросы: {questions}")
 
-    prompt = f"""
-Проанализируйте проект и верните строго валидный JSON с:
-1. "strengths": 3-5 сильных сторон (массив строк)
-2. "weaknesses": 3-5 слабых сторон с рекомендациями (массив строк)
-3. "fact_check": 3-4 проверки ключевых утверждений, будь придирчив и въедлив (массив объектов с полями claim, verdict, explanation)
-4. "storytelling_script": сценарий выступления ({tone}) - объект с полями introduction, main_part, conclusion
-5. "tricky_questions": 4-5 очень каверзных вопросов, как при защите диссертации (массив строк)
+SECTION_RENDERERS = {
+    "strengths": (render_strengths, []),
+    "weaknesses": (render_weaknesses, []),
+    "fact_check": (render_fact_check, []),
+    "storytelling_script": (render_storytelling_script, {}),
+    "tricky_questions": (render_tricky_questions, []),
+}
 
-Проект:
-{project_text}
-"""
+def create_result_view():
+    # Вкладки создаются заранее: у каждого раздела своё место, которое можно
+    # заполнить, как только раздел готов
+    tabs = st.tabs(["📊 Сильные/Слабые стороны", "🔍 Фактчек", "🎤 Выступление", "❓ Вопросы"])
+    with tabs[0]:
+        col1, col2 = st.columns(2)
+        with col1:
+            strengths = st.empty()
+        with col2:
+            weaknesses = st.empty()
+    with tabs[1]:
+        fact_check = st.empty()
+    with tabs[2]:
+        storytelling_script = st.empty()
+    with tabs[3]:
+        tricky_questions = st.empty()
+    placeholders = {
+        "strengths": strengths,
+        "weaknesses": weaknesses,
+        "fact_check": fact_check,
+        "storytelling_script": storytelling_script,
+        "tricky_questions": tricky_questions,
+    }
+    for placeholder in placeholders.values():
+        placeholder.caption("⏳ Раздел готовится...")
+    return placeholders
 
-    try:
-        response = client.chat.completions.create(
-            model="deepseek-ai/DeepSeek-R1",  # Используем указанную модель
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5,
-            top_p=0.8,
-            max_tokens=2000,  # Увеличено для лучшего качества
-            response_format={"type": "json_object"}
-        )
-        return json.loads(response.choices[0].message.content)
-    except Exception as e:
-        st.error(f"Ошибка при вызове API: {e}")
-        return None
+def render_section(placeholders: dict, key: str, value):
+    if key not in SECTION_RENDERERS:
+        return
+    renderer, default = SECTION_RENDERERS[key]
+    with placeholders[key].container():
+        renderer(default if value is None else value)
+
+# --- Панель метрик (открывается по адресу с ?admin=1) ---
+def _format_labels(labels: dict) -> str:
+    return ", ".join(f"{name}={value}" for name, value in labels.items())
+
+def render_admin_panel():
+    with st.sidebar:
+        st.header("📊 Метрики процесса")
+        rows = METRICS.snapshot()
+        if not rows:
+            st.caption("Пока нет наблюдений")
+            return
+        st.subheader("Задержки, сек (последние наблюдения)")
+        st.dataframe([{"метрика": row["metric"], "метки": _format_labels(row["labels"]),
+                       "p50": round(row["p50"], 2), "p95": round(row["p95"], 2), "n": row["count"]}
+                      for row in rows], hide_index=True)
+        st.subheader("Счётчики с запуска")
+        st.dataframe([{"метрика": row["metric"], "метки": _format_labels(row["labels"]),
+                       "значение": round(row["value"], 4)}
+                      for row in METRICS.counters()], hide_index=True)
+        st.subheader("Очередь к моделям")
+        st.dataframe(get_scheduler().stats(), hide_index=True)
+        st.caption(f"Подзадач ждут свободный поток: {get_executor().waiting()}")
+        if st.button("💾 Записать metrics.prom"):
+            METRICS.flush(force=True)
+            st.caption(f"Записано в {METRICS.path}")
+
+if st.query_params.get("admin") == "1":
+    render_admin_panel()
 
 # --- Интерфейс приложения ---
 st.title("🤖 Эксперт по подготовке к защите")
@@ -262,121 +248,148 @@ with col2:
 
     #st.button("✍️ Пример текста", on_click=load_example_text, use_container_width=True)
 
-tone = st.selectbox("🎭 Стиль выступления", ["Вдохновляющий", "Формальный", "Научно-популярный"], index=0)
+tone = st.selectbox("🎭 Стиль выступления", TONES, index=0)
+stream_mode = st.checkbox("⚡ Показывать разделы по мере готовности", value=True,
+                          help="Потоковый режим: каждая вкладка заполняется, как только готов её раздел")
+sectioned_mode = st.checkbox("🧩 Параллельный анализ по разделам", value=False,
+                             help="Каждый раздел запрашивается отдельно и одновременно с остальными; "
+                                  "ошибка в одном разделе не ломает остальные вкладки")
+all_tones_mode = st.checkbox("🎭 Сценарии сразу для всех стилей", value=False,
+                             help="Общие разделы считаются один раз, сценарии для всех стилей — параллельно. "
+                                  "Смена стиля после этого берёт готовый результат из кэша")
+
+# Пока проверка этой сессии идёт, новую не запускаем: повторный клик дал бы
+# второй полный анализ мимо кэша и занял бы место в общей очереди задач
+active_job_id = st.session_state.get("analysis_job_id") or st.query_params.get("job")
+active_job = get_job_manager().get(active_job_id) if active_job_id else None
+job_running = active_job is not None and active_job.active
+
+button_col, regenerate_col = st.columns([4, 1])
+with button_col:
+    analyze_clicked = st.button("🚀 Проанализировать проект", type="primary", use_container_width=True,
+                                disabled=job_running)
+with regenerate_col:
+    regenerate_clicked = st.button("🔄 Сгенерировать заново", use_container_width=True, disabled=job_running,
+                                   help="Игнорировать сохранённый результат и запросить новый анализ")
+
+# Сессия браузера: по ней делится очередь запросов к моделям и ищутся прошлые
+# версии файла. Как и id задачи, хранится в адресе: переживает обновление вкладки
+session_id = st.session_state.setdefault("session_id", st.query_params.get("session") or uuid.uuid4().hex)
+st.query_params["session"] = session_id
 
-if st.button("🚀 Проанализировать проект", type="primary", use_container_width=True):
-    project_text = ""
-    image_descriptions = ""
-    
+upload_error = None
+overloaded = None
+if (analyze_clicked or regenerate_clicked) and not job_running:
+    upload = None
     if uploaded_file is not None:
-        with st.spinner("Извлечение данных..."):
-            start_time = time.time()
-            file_name = uploaded_file.name.lower()
-            
-            if file_name.endswith('.pptx'):
-                images = extract_images_from_pptx(uploaded_file)
-                if images:
-                    image_descriptions = recognize_images(images)
-                project_text = extract_text_from_pptx(uploaded_file)
-                
-            elif file_name.endswith('.pdf'):
-                images = extract_images_from_pdf(uploaded_file)
-                if images:
-                    image_descriptions = recognize_images(images)
-                project_text = extract_text_from_pdf(uploaded_file)
-            
-            extraction_time = time.time() - start_time
-            st.caption(f"⏱️ Извлечение заняло: {extraction_time:.1f} сек")
-
-    # Объединяем данные
-    combined_text = "".join(filter(None, [image_descriptions, project_text, report_text]))
-
-    if not combined_text.strip():
-        st.warning("Загрузите файл или введите текст")
-    else:
-        with st.spinner("Анализ ИИ... (~45-90 секунд)"):
-            start_time = time.time()
-            analysis_result = get_analysis_from_deepseek(combined_text, tone)
-            analysis_time = time.time() - start_time
-            st.caption(f"⏱️ Анализ занял: {analysis_time:.1f} сек")
-            
-            if analysis_result:
-                # Отображение результатов
-                st.success("✅ Анализ завершен! Если не получилось — смело попробуй еще раз!")
-                
-                tabs = st.tabs(["📊 Сильные/Слабые стороны", "🔍 Фактчек", "🎤 Выступление", "❓ Вопросы"])
-                
-                with tabs[0]:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write("**Сильные стороны:**")
-                        strengths = analysis_result.get("strengths", [])
-                        if isinstance(strengths, list):
-                            for strength in strengths:
-                                st.success(f"✅ {strength}")
-                        else:
-                            st.success(f"✅ {strengths}")
-                            
-                    with col2:
-                        st.write("**Для улучшения:**")
-                        weaknesses = analysis_result.get("weaknesses", [])
-                        if isinstance(weaknesses, list):
-                            for weakness in weaknesses:
-                                st.warning(f"⚠️ {weakness}")
-                        else:
-                            st.warning(f"⚠️ {weaknesses}")
-                
-                with tabs[1]:
-                    st.write("**Проверка фактов:**")
-                    fact_checks = analysis_result.get("fact_check", [])
-                    if isinstance(fact_checks, list):
-                        for fact in fact_checks:
-                            if isinstance(fact, dict):
-                                claim = fact.get('claim', '')
-                                verdict = fact.get('verdict', '')
-                                explanation = fact.get('explanation', '')
-                                with st.expander(f"**{claim}**"):
-                                    st.write(f"**Вердикт:** {verdict}")
-                                    st.write(f"**Объяснение:** {explanation}")
-                            else:
-                                st.write(f"**Факт:** {fact}")
-                    else:
-                        st.write(f"**Факты:** {fact_checks}")
-                
-                with tabs[2]:
-                    st.write("**Сценарий выступления:**")
-                    script = analysis_result.get("storytelling_script", {})
-                    
-                    # Проверяем тип данных script
-                    if isinstance(script, str):
-                        # Если это строка, пытаемся преобразовать в JSON
-                        try:
-                            script = json.loads(script)
-                        except:
-                            st.write(script)
-                            script = {}
-                    
-                    if isinstance(script, dict):
-                        sections = [
-                            ("🎯 Вступление", "introduction"),
-                            ("📝 Основная часть", "main_part"), 
-                            ("🏁 Заключение", "conclusion")
-                        ]
-                        for title, key in sections:
-                            content = script.get(key, "")
-                            if content:
-                                with st.expander(title, expanded=len(content) < 300):
-                                    st.write(content)
-                    else:
-                        st.write("Сценарий:", script)
-                
-                with tabs[3]:
-                    st.write("**Каверзные вопросы:**")
-                    questions = analysis_result.get("tricky_questions", [])
-                    if isinstance(questions, list):
-                        for i, question in enumerate(questions, 1):
-                            st.info(f"{i}. {question}")
-                    else:
-                        st.info(f"Вопросы: {questions}")
+        # Загрузка переписывается во временный файл: объект загрузки может стать
+        # недоступен после перезапуска скрипта, а копии в памяти не нужны
+        try:
+            upload = spool_upload(uploaded_file)
+        except UploadTooLargeError as e:
+            upload_error = str(e)
+    if upload_error is None:
+        session_client = ScheduledClient(client, get_scheduler(), session_id) if client else None
+        session_executor = get_executor().for_session(session_id)
+        try:
+            job_id = get_job_manager().submit(analysis_job, session_client, session_executor, get_analysis_cache(),
+                                              get_ocr_pool(), get_parsed_store(), upload, report_text, tone,
+                                              regenerate_clicked, stream_mode, sectioned_mode, all_tones_mode,
+                                              session_id)
+        except OverloadedError as e:
+            overloaded = str(e)
+            if upload is not None:
+                upload.close()
+        else:
+            st.session_state.analysis_job_id = job_id
+            # id задачи и в адресе страницы: после обновления вкладки результат подхватится
+            st.query_params["job"] = job_id
+            get_job_manager().wait(job_id, JOB_FAST_PATH_SECONDS)
+
+if upload_error:
+    st.error(upload_error)
+if overloaded:
+    st.warning(f"⏳ {overloaded}")
+
+job_id = st.session_state.get("analysis_job_id") or st.query_params.get("job")
+job = get_job_manager().get(job_id) if job_id else None
+if job_id and job is None:
+    # Задача не найдена: например, сервер перезапустился, пока она выполнялась
+    st.session_state.pop("analysis_job_id", None)
+    st.query_params.pop("job", None)
+
+if job is not None:
+    st.session_state.analysis_job_id = job.id
+    info_area = st.container()
+    results_area = st.empty()
+    placeholders = {}
+
+    if job.active:
+        elapsed = time.time() - job.submitted
+        job_position = get_job_manager().queue_position(job.id)
+        model_position = get_scheduler().position(session_id)
+        if job_position is not None:
+            info_area.info(f"⏳ Проверка в очереди: {job_position}-я, ожидание {elapsed:.0f} сек. "
+                           "Можно менять настройки — место в очереди не потеряется")
+        elif model_position is not None:
+            info_area.info(f"⏳ Ждём свободную модель: вы {model_position}-й в очереди, {elapsed:.0f} сек. "
+                           "Можно менять настройки — результат не потеряется")
+        else:
+            info_area.info(f"⏳ Извлечение и анализ ИИ... {elapsed:.0f} сек (~45-90 секунд). "
+                           "Можно менять настройки — результат не потеряется")
+        if job.sections:
+            with results_area.container():
+                placeholders = create_result_view()
+            for key, value in job.sections.items():
+                render_section(placeholders, key, value)
+        # Завершится раньше — перерисуем сразу, не досыпая интервал
+        get_job_manager().wait(job.id, JOB_POLL_SECONDS)
+        st.rerun()
+
+    run = job.result or {}
+    with info_area:
+        if job.status == "failed":
+            st.error(f"Ошибка анализа: {job.error}")
+        for error in run.get("errors", []):
+            st.error(error)
+
+        if run.get("empty_input"):
+            st.warning("Загрузите файл или введите текст")
+        elif job.status == "done":
+            if run["from_cache"]:
+                st.caption("⚡ Результат из кэша. Нажмите «Сгенерировать заново» для нового анализа")
+            revision = run.get("revision")
+            if revision and not run["from_cache"] and "changes" in (run["analysis"] or {}):
+                st.caption(f"🔁 Повторная проверка: изменено {revision['changed']} из {revision['total']} "
+                           f"слайдов, удалено {revision['removed']}. Проанализированы только изменения")
+            st.caption(f"⏱️ {format_timings(run['timings'])}")
+            if run.get("tokens_saved"):
+                st.caption(f"✂️ Убраны колонтитулы, номера страниц и переносы: ~{run['tokens_saved']} токенов")
+            if run.get("parsed_from_memory"):
+                st.caption("📄 Файл уже был разобран — повторно запрошен только анализ")
+            if run["cached_captions"]:
+                st.caption(f"🖼️ Подписей к изображениям из кэша: {run['cached_captions']}")
+            if run["image_descriptions"]:
+                with st.expander("🖼️ Описание изображений"):
+                    st.text(run["image_descriptions"])
+
+            if run["analysis"]:
+                st.success("✅ Анализ завершен!")
+                if not run["from_cache"] and run["analysis"].get("changes"):
+                    st.markdown("**Что изменилось с прошлой версии:**\n" + "\n".join(
+                        f"- {change}" for change in run["analysis"]["changes"]))
             else:
                 st.error("Ошибка анализа. Проверьте API ключ и попробуйте позже.")
+
+    analysis_result = run.get("analysis")
+    if analysis_result:
+        # Отображение результатов: итог всегда перерисовываем из полного ответа
+        with results_area.container():
+            placeholders = create_result_view()
+        section_errors = analysis_result.get("section_errors", {})
+        for key in ANALYSIS_SECTIONS:
+            if key in section_errors:
+                placeholders[key].warning(f"⚠️ Раздел не удалось получить: {section_errors[key]}. "
+                                          "Нажмите «Сгенерировать заново»")
+            else:
+                render_section(placeholders, key, analysis_result.get(key))
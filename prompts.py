@@ -0,0 +1,249 @@
+from dataclasses import dataclass
+
+
+# --- Версионированные шаблоны промптов ---
+# Постоянная часть каждого запроса — отдельное системное сообщение, байт в байт
+# одинаковое между вызовами; всё переменное (текст проекта, тон, список полей)
+# идёт последним в сообщении пользователя. Так провайдер может переиспользовать
+# KV-кэш общего префикса: инструкции, а для дозапросов и разных тонов — ещё и
+# текст проекта. Любая правка текста шаблона — новая версия: версия входит в
+# ключи кэша результатов.
+
+EXAMPLE_STORYTELLING_TEXT = """Добрый день, уважаемые коллеги, эксперты, партнёры.
+Сегодня мы представляем проект, который находится на пересечении технологий будущего, устойчивого развития и новой философии взаимодействия с мировым океаном.
+Проект «Спрут» — это не просто прототип. Это шаг в сторону цивилизованной, экологичной и высокотехнологичной добычи донных полиметаллических конкреций.
+Почему это важно?
+Полиметаллические конкреции — это настоящие сокровища океанского дна.
+Они содержат стратегически важные металлы: марганец, никель, кобальт, медь — именно те, что лежат в основе «зелёной» энергетики, аккумуляторов, микроэлектроники и электротранспорта.
+На дне океанов этих ресурсов в 3–4 раза больше, чем на всей суше.
+Общие запасы — более 500 миллиардов тонн, из которых половина — полезные минералы.
+Это колоссальный потенциал, который может обеспечить человечество сырьём на десятилетия вперёд.
+Но есть проблема.
+Современные методы добычи устарели и наносят катастрофический урон экосистемам.
+При работе тяжёлых драг гибнет более 51% микроорганизмов. Разрушаются биосообщества, нарушается устойчивость экосистем.
+При этом спрос на океанические ресурсы не просто растёт — он взрывается.
+Количество лицензий на добычу в России с 2020 по 2024 год выросло на 200%.
+А мировой рынок подводных технологий демонстрирует рост на 43% в год.
+Что мы предложили
+Наша задача: создать технологию, которая не разрушает — а бережно взаимодействует с природой.
+Изучив существующие решения, проанализировав патенты и собрав межрегиональную команду инженеров, мы разработали принципиально новый подход к подводной добыче.
+Так родился «Спрут».
+Что такое «Спрут»?
+Это мобильная автономная платформа с биомиметическим манипулятором, вдохновлённым природой — щупальцами осьминога и хоботом слона.
+Ключевые особенности:
+Манипулятор построен по логарифмической спирали — он способен работать с объектами различной формы и диаметра.
+Поднимает предметы в 260 раз тяжелее собственного веса.
+Управление — как в ручном режиме через приложение, так и в автономном.
+Встроенное машинное зрение определяет и классифицирует конкреции прямо на дне.
+Что уже сделано
+Мы прошли ключевые этапы:
+Исследования и патентный анализ
+Создание 3D-моделей, разработка электронных компонентов
+Сборка и настройка первого прототипа
+Первичные испытания в лабораторных условиях
+Сегодня у нас — действующий макет манипулятора, рабочая платформа, система управления и программное обеспечение.
+Что изменится?
+Сравнив нашу систему с традиционными методами, мы получили:
+Снижение повреждений донного грунта на 72%
+Подъём одной конкреции — за 10 секунд
+Скорость передвижения платформы — до 15 км/ч
+Автономная работа — до 1,8 часов на одной зарядке
+Платформа адаптируется к различным морфологиям дна — мы разработали три её конфигурации.
+Кому это выгодно?
+Государству — развитие технологического суверенитета и снижение зависимости от импорта
+Бизнесу — экологичный имидж, снижение штрафных рисков, экспортный потенциал
+Учёным — этичный инструмент для глубоководных исследований
+Природе — потому что мы не нарушаем её, а работаем в гармонии с ней
+Кто мы?
+Мы — команда из 9 инженеров, программистов и схемотехников из разных регионов России.
+Нас объединяет страсть к подводной робототехнике и желание переопределить правила в отрасли.
+Что дальше?
+Проект готов к следующему шагу — испытаниям в реальных морских условиях.
+Нам необходимо:
+Провести испытания в открытой воде
+Дооснастить платформу системой связи и стабилизации
+Найти партнёра для запуска пилотного промышленного контракта
+Финал
+«Спрут» — это не просто машина. Это философия.
+Философия бережного, уважительного и умного освоения океана.
+Мы верим, что технологии должны быть союзниками природы — а не её врагами.
+И если океан — это последнее великое неизведанное пространство на Земле,
+мы готовы идти туда. Но идти иначе. С умом, с уважением — и с инновациями.
+Спасибо за внимание.
+"""
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    version: str
+    system: str
+    user: str  # Шаблон str.format; переменные только здесь
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}-{self.version}"
+
+    def messages(self, **values) -> list:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**values)},
+        ]
+
+
+SECTION_SCHEMAS = {
+    "strengths": "3-5 сильных сторон (массив строк)",
+    "weaknesses": "3-5 слабых сторон с рекомендациями (массив строк)",
+    "fact_check": "3-4 проверки ключевых утверждений, будь придирчив и въедлив "
+                  "(массив объектов с полями claim, verdict, explanation)",
+    "storytelling_script": "сценарий выступления в указанном стиле - объект с полями introduction, main_part, conclusion",
+    "tricky_questions": "4-5 очень каверзных вопросов, как при защите диссертации (массив строк)",
+}
+
+STORYTELLING_INSTRUCTION = f"""
+Сценарий выступления — захватывающий, в стиле TED, в тоне, указанном в конце запроса, с чётким разделением на три части:
+1. "introduction": мощное вступление — обозначьте проблему и представьте название проекта
+2. "main_part": развернутая основная часть — опишите цель, ход работы и ключевую новизну проекта, укажи основные элементы детали.
+3. "conclusion": убедительное заключение — подведите итоги и подчеркните значимость результатов
+
+(Стиль: живой, конкретный, без абстракций)
+Выдай текст схожий по размеру и каечству как тут: {EXAMPLE_STORYTELLING_TEXT}
+"""
+
+_ALL_FIELDS = "\n".join(f'{idx}. "{key}": {schema}' for idx, (key, schema) in enumerate(SECTION_SCHEMAS.items(), start=1))
+
+# Хвост сообщения пользователя общий для анализа и дозапросов: текст проекта
+# раньше тона, чтобы анализы одного документа в разных тонах делили префикс
+_PROJECT_TAIL = """Проект:
+{project_text}
+
+Стиль выступления: {tone}"""
+
+# Как и в исходном промпте, анализ одним запросом — без примера сценария:
+# пример (~1600 токенов) и сценарий его размера не умещаются в бюджет ответа
+# вместе с остальными разделами. Подробная инструкция — в запросе раздела
+ANALYSIS_TEMPLATE = PromptTemplate(
+    name="analysis",
+    version="3",
+    system=f"""Проанализируйте проект из сообщения пользователя и верните строго валидный JSON с:
+{_ALL_FIELDS}""",
+    user=_PROJECT_TAIL,
+)
+
+# Тот же системный промпт и то же начало сообщения, что у анализа: префикс
+# вместе с текстом проекта уже в кэше провайдера
+CONTINUATION_TEMPLATE = PromptTemplate(
+    name="continuation",
+    version="2",
+    system=ANALYSIS_TEMPLATE.system,
+    user=_PROJECT_TAIL + """
+
+Верните JSON только с полями: {fields}""",
+)
+
+# Разделы, не зависящие от тона: тот же системный промпт, без тона в запросе.
+# Используется в режиме «все тона сразу» и для дозапроса таких разделов
+CORE_TEMPLATE = PromptTemplate(
+    name="core",
+    version="2",
+    system=ANALYSIS_TEMPLATE.system,
+    user="""Проект:
+{project_text}
+
+Верните JSON только с полями: {fields}""",
+)
+
+SECTION_TEMPLATE_VERSION = "2"
+
+SECTION_TEMPLATES = {
+    key: PromptTemplate(
+        name=f"section-{key}",
+        version=SECTION_TEMPLATE_VERSION,
+        system=(f"""Проанализируйте проект из сообщения пользователя и верните строго валидный JSON с единственным полем:
+"{key}": {schema}
+"""
+                + (STORYTELLING_INSTRUCTION if key == "storytelling_script" else "")),
+        user=_PROJECT_TAIL,
+    )
+    for key, schema in SECTION_SCHEMAS.items()
+}
+
+SUMMARY_TEMPLATE = PromptTemplate(
+    name="summary",
+    version="2",
+    system="""Пользователь присылает фрагмент материалов студенческого проекта.
+Сожмите его примерно втрое. Сохраните дословно все числа, проценты, даты, названия,
+ключевые утверждения и выводы — по ним потом будет проверка фактов. Без вступлений и оценок.""",
+    user="""Фрагмент {idx} из {total}:
+{chunk}""",
+)
+
+DELTA_TEMPLATE = PromptTemplate(
+    name="delta",
+    version="2",
+    system=f"""Студент загрузил исправленную версию презентации. В сообщении пользователя — разбор
+прошлой версии (JSON) и только изменённые или новые слайды. Верните строго валидный JSON:
+"changes": 2-5 строк — что изменилось и какие прежние замечания устранены (массив строк),
+и только те разделы из списка ниже, на которые изменения влияют, в прежнем формате:
+{_ALL_FIELDS}""",
+    user="""Разбор прошлой версии:
+{previous}
+
+Удалённые слайды:
+{removed}
+
+Изменённые и новые слайды:
+{changed}
+
+Стиль выступления: {tone}""",
+)
+
+# Проверка фактов по найденным фрагментам (passage_index.py): вместо всего
+# текста проекта — только численные утверждения и слайды, где о них говорится
+FACT_CHECK_TEMPLATE = PromptTemplate(
+    name="fact-check",
+    version="1",
+    system="""Пользователь присылает численные утверждения из студенческого проекта и для каждого —
+фрагменты слайдов, где о нём говорится, с номерами слайдов. Будьте придирчивы и въедливы:
+правдоподобна ли величина, согласуется ли она с другими слайдами, указан ли источник,
+корректно ли сравнение. Верните строго валидный JSON:
+"fact_check": массив объектов с полями claim (утверждение), verdict (вердикт),
+explanation (объяснение), slides (номера слайдов, на которые опирается вердикт, массив чисел)""",
+    user="""Утверждения и фрагменты:
+{evidence}""",
+)
+
+# Когда численные утверждения проверяются по слайдам (FACT_CHECK_TEMPLATE),
+# основной запрос проверку фактов не делает: те же шаблоны без поля
+# fact_check, со своими версиями — и своими ключами кэша
+_GROUNDED_SCHEMAS = {key: schema for key, schema in SECTION_SCHEMAS.items() if key != "fact_check"}
+_GROUNDED_FIELDS = "\n".join(f'{idx}. "{key}": {schema}'
+                             for idx, (key, schema) in enumerate(_GROUNDED_SCHEMAS.items(), start=1))
+
+GROUNDED_ANALYSIS_TEMPLATE = PromptTemplate(
+    name="analysis-grounded",
+    version="1",
+    system=ANALYSIS_TEMPLATE.system.replace(_ALL_FIELDS, _GROUNDED_FIELDS),
+    user=ANALYSIS_TEMPLATE.user,
+)
+
+GROUNDED_CONTINUATION_TEMPLATE = PromptTemplate(
+    name="continuation-grounded",
+    version="1",
+    system=GROUNDED_ANALYSIS_TEMPLATE.system,
+    user=CONTINUATION_TEMPLATE.user,
+)
+
+GROUNDED_CORE_TEMPLATE = PromptTemplate(
+    name="core-grounded",
+    version="1",
+    system=GROUNDED_ANALYSIS_TEMPLATE.system,
+    user=CORE_TEMPLATE.user,
+)
+
+GROUNDED_DELTA_TEMPLATE = PromptTemplate(
+    name="delta-grounded",
+    version="1",
+    system=DELTA_TEMPLATE.system.replace(_ALL_FIELDS, _GROUNDED_FIELDS),
+    user=DELTA_TEMPLATE.user,
+)
@@ -0,0 +1,257 @@
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+from telemetry import METRICS
+
+
+# --- Устойчивый слой поверх клиента OpenAI ---
+# Повторы с экспоненциальной задержкой и случайным разбросом (с учётом
+# Retry-After), общий на процесс ограничитель скорости (token bucket),
+# предохранитель (circuit breaker) для каждой модели — сбои одной не
+# блокируют другую — и, по желанию, дублирующий запрос, если
+# ответ задерживается дольше p95 недавних вызовов той же модели.
+# Интерфейс тот же: client.chat.completions.create(...). Каждый вызов, повтор
+# и дубликат попадает в метрики (telemetry.py).
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float = None):
+        self.rate = rate_per_second
+        self.capacity = capacity or max(1.0, rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class CircuitBreaker:
+    # closed -> (failure_threshold сбоев подряд) -> open -> (reset_timeout) ->
+    # half-open: пропускается ровно один пробный запрос, остальные отклоняются,
+    # пока он не завершится. Успех пробы закрывает предохранитель, сбой — снова открывает
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._probing else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None  # Ни число, ни дата: обычная задержка с разбросом
+    return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+class ResilientClient:
+    def __init__(self, client, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                 rate_limiter: TokenBucket = None, breaker_factory=CircuitBreaker,
+                 hedge: bool = False, hedge_quantile: float = 0.95, hedge_min_samples: int = 20,
+                 metrics=METRICS):
+        self.client = client
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = rate_limiter
+        self.breaker_factory = breaker_factory
+        self._breakers = {}  # model -> CircuitBreaker
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge") if hedge else None
+        self.chat = _Chat(self)
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = self.breaker_factory()
+            return breaker
+
+    def create(self, **kwargs):
+        model = kwargs.get("model")
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            self.metrics.increment("llm_circuit_open_total", model=model)
+            raise CircuitOpenError("Сервис модели временно недоступен, повторите попытку через минуту")
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._attempt(kwargs)
+            except Exception as e:
+                if not _is_retryable(e):
+                    # Ошибка не от недоступности сервиса (например, 400): проба завершена, сервис жив
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if attempt == self.max_retries or not breaker.allow():
+                    raise
+                self.metrics.increment("llm_retries_total", model=model,
+                                       status=getattr(e, "status_code", None) or type(e).__name__)
+                time.sleep(self._backoff(attempt, e))
+                continue
+            breaker.record_success()
+            return response
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # "Full jitter": равномерно от 0 до экспоненциального потолка
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _attempt(self, kwargs: dict):
+        threshold = None if kwargs.get("stream") else self._hedge_threshold(kwargs.get("model"))
+        if threshold is None:
+            return self._call(kwargs)
+        primary = self._hedge_pool.submit(self._call, kwargs)
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+        # Основной запрос задержался дольше обычного: отправляем дубликат и берём первый ответ
+        self.metrics.increment("llm_hedged_total", model=kwargs.get("model"))
+        backup = self._hedge_pool.submit(self._call, kwargs)
+        done, _ = wait([primary, backup], return_when=FIRST_COMPLETED)
+        finished = done.pop()
+        if finished.exception() is not None:
+            other = backup if finished is primary else primary
+            return other.result()
+        return finished.result()
+
+    def _call(self, kwargs: dict):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        model = kwargs.get("model")
+        start_time = time.monotonic()
+        try:
+            response = self.client.chat.completions.create(**kwargs)
+        except Exception:
+            self.metrics.record_llm_call(model, time.monotonic() - start_time, status="error",
+                                         stream=bool(kwargs.get("stream")))
+            raise
+        if kwargs.get("stream"):
+            return self._instrument_stream(model, response, start_time)
+        elapsed = time.monotonic() - start_time
+        self._record_latency(model, elapsed)
+        self.metrics.record_llm_call(model, elapsed, getattr(response, "usage", None))
+        return response
+
+    def _instrument_stream(self, model: str, stream, start_time: float):
+        # Время до первого фрагмента и usage из последнего (если провайдер его присылает)
+        first_token = None
+        usage = None
+        status = "error"
+        try:
+            for chunk in stream:
+                if first_token is None:
+                    first_token = time.monotonic() - start_time
+                usage = getattr(chunk, "usage", None) or usage
+                yield chunk
+            status = "ok"
+        finally:
+            self.metrics.record_llm_call(model, time.monotonic() - start_time, usage, status=status,
+                                         stream=True, first_token=first_token)
+
+    def _record_latency(self, model: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=200)).append(seconds)
+
+    def _hedge_threshold(self, model: str):
+        if not self.hedge:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile))]
+
+
+class _Completions:
+    def __init__(self, owner: ResilientClient):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner.create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, owner: ResilientClient):
+        self.completions = _Completions(owner)
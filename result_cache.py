@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# --- Постоянный кэш результатов на SQLite ---
+# Переживает перезапуск Streamlit. Записи старше ttl_seconds удаляются,
+# а при превышении max_bytes вытесняются давно не читавшиеся записи.
+
+CACHE_DIR = os.environ.get("PROJECT_CHECKER_CACHE_DIR", ".cache")
+
+
+def make_key(*parts) -> str:
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path=None, table="results", ttl_seconds=7 * 24 * 3600,
+                 max_bytes=200 * 1024 * 1024):
+        self.path = path or os.path.join(CACHE_DIR, "results.sqlite3")
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value):
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, payload, now, now, len(payload.encode("utf-8"))),
+            )
+            self._evict(conn, now)
+
+    def delete(self, key: str):
+        with self._lock, self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def _evict(self, conn, now):
+        conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (now - self.ttl_seconds,))
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Вытесняем самые давно читавшиеся записи, пока не уложимся в лимит
+        for key, size in conn.execute(
+            f"SELECT key, size FROM {self.table} ORDER BY accessed ASC"
+        ).fetchall():
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
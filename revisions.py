@@ -0,0 +1,89 @@
+import time
+from dataclasses import dataclass, field
+
+from analysis import ANALYSIS_MODEL, DELTA_PROMPT_VERSION, GROUNDED_DELTA_PROMPT_VERSION
+from result_cache import make_key
+
+
+# --- Версии одной и той же презентации ---
+# После удачного анализа запоминаем отпечатки страниц и результат под
+# владельцем (сессия в приложении, путь к файлу в пакетной проверке), именем
+# файла и тоном: чужой «project.pptx» с тем же именем прошлой версией не
+# считается. Если следующая загрузка того же владельца совпадает с прошлой
+# хотя бы наполовину, это исправленная версия: анализируем только изменения
+# (см. analysis.get_delta_analysis). Подписи к картинкам и сводки фрагментов
+# неизменённых слайдов и так берутся из кэша.
+
+REVISION_MIN_OVERLAP = 0.5  # Доля неизменённых страниц, начиная с которой считаем это новой версией
+
+
+@dataclass
+class RevisionDiff:
+    previous_analysis: dict
+    kind: str = "pptx"
+    changed: list = field(default_factory=list)  # PageRecord изменённых и новых страниц
+    removed: list = field(default_factory=list)  # Заголовки удалённых страниц
+    total: int = 0
+
+    def changed_text(self) -> str:
+        return "\n\n".join(page.serialize(self.kind) for page in self.changed)
+
+    def summary(self) -> dict:
+        return {"changed": len(self.changed), "removed": len(self.removed), "total": self.total}
+
+
+def revision_key(owner: str, source: str, tone: str) -> str:
+    # Сохранённая версия годится для обоих вариантов шаблона изменений (с проверкой фактов и без)
+    return make_key("revision", owner, source, tone, ANALYSIS_MODEL, DELTA_PROMPT_VERSION, GROUNDED_DELTA_PROMPT_VERSION)
+
+
+def _report_key(report_text: str) -> str:
+    return make_key(" ".join((report_text or "").split()))
+
+
+def _page_title(page) -> str:
+    return page.title or f"№{page.number}"
+
+
+def _deleted(changed: list, gone: list) -> list:
+    # Исчезнувший отпечаток — это правка, если изменённый слайд с тем же
+    # заголовком или на том же месте есть в новой версии; иначе — удаление
+    gone = list(gone)
+    unmatched = list(changed)
+    for match in (lambda page, old: _page_title(page) == old["title"],
+                  lambda page, old: page.number == old.get("number")):
+        for page in list(unmatched):
+            old = next((old for old in gone if match(page, old)), None)
+            if old is not None:
+                gone.remove(old)
+                unmatched.remove(page)
+    return [old["title"] for old in gone]
+
+
+def save_revision(cache, owner: str, parsed, tone: str, report_text: str, analysis: dict):
+    pages = [{"fingerprint": page.fingerprint, "title": _page_title(page), "number": page.number}
+             for page in parsed.pages if page.has_content]
+    cache.set(revision_key(owner, parsed.source, tone), {
+        "pages": pages,
+        "report": _report_key(report_text),
+        "analysis": {key: value for key, value in analysis.items() if key != "changes"},
+        "saved": time.time(),
+    })
+
+
+def diff_revision(cache, owner: str, parsed, tone: str, report_text: str):
+    # RevisionDiff, если есть подходящая прошлая версия, иначе None
+    stored = cache.get(revision_key(owner, parsed.source, tone))
+    if not stored or stored["report"] != _report_key(report_text):
+        return None
+    pages = [page for page in parsed.pages if page.has_content]
+    previous = {page["fingerprint"]: page["title"] for page in stored["pages"]}
+    current = {page.fingerprint for page in pages}
+    changed = [page for page in pages if page.fingerprint not in previous]
+    if not pages or len(pages) - len(changed) < REVISION_MIN_OVERLAP * max(len(pages), len(previous)):
+        return None
+    removed = _deleted(changed, [page for page in stored["pages"] if page["fingerprint"] not in current])
+    if not changed and not removed:
+        return None  # Содержимое не менялось: сработает обычный кэш анализа
+    return RevisionDiff(previous_analysis=stored["analysis"], kind=parsed.kind, changed=changed,
+                        removed=removed, total=len(pages))
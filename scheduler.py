@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from resilient_client import _Chat
+from telemetry import METRICS
+
+
+# --- Общая на процесс очередь запросов к моделям ---
+# Одновременных запросов к каждой модели не больше её лимита, сколько бы
+# студентов ни запустили проверку. Ожидающие запросы стоят в очередях по
+# сессиям, освободившееся место отдаётся сессиям по кругу: десять запросов
+# одной сессии (анализ по разделам) не задерживают первый запрос другой.
+# Так же по кругу раздаются и потоки общего пула (FairExecutor): подзадачи
+# одной сессии не занимают все потоки раньше, чем до модели дойдёт другая.
+# Если очередь к модели переполнена или ждать приходится слишком долго —
+# OverloadedError с понятным сообщением вместо троттлинга у провайдера.
+
+MODEL_CONCURRENCY = {
+    "deepseek-ai/DeepSeek-R1": 8,
+    "google/gemma-3-27b-it": 4,
+}
+DEFAULT_CONCURRENCY = 4
+MAX_WAITING_PER_MODEL = 64
+MAX_WAIT_SECONDS = 180.0
+MAX_QUEUED_JOBS = 50  # Задач анализа в очереди JobManager, дальше новые не принимаются
+
+OVERLOAD_MESSAGE = "Сейчас проверяется слишком много проектов — попробуйте через пару минут"
+
+
+class OverloadedError(Exception):
+    pass
+
+
+class FairScheduler:
+    def __init__(self, caps: dict = None, default_cap: int = DEFAULT_CONCURRENCY,
+                 max_waiting: int = MAX_WAITING_PER_MODEL, max_wait: float = MAX_WAIT_SECONDS, metrics=METRICS):
+        self.caps = dict(MODEL_CONCURRENCY if caps is None else caps)
+        self.default_cap = default_cap
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.metrics = metrics
+        self._running = {}  # model -> число выполняющихся запросов
+        self._queues = {}  # model -> OrderedDict(session -> deque[Event]); порядок ключей — очерёдность по кругу
+        self._lock = threading.Lock()
+
+    def acquire(self, model: str, session: str):
+        start_time = time.monotonic()
+        with self._lock:
+            sessions = self._queues.setdefault(model, OrderedDict())
+            if not sessions and self._running.get(model, 0) < self.caps.get(model, self.default_cap):
+                self._running[model] = self._running.get(model, 0) + 1
+                return
+            if sum(len(events) for events in sessions.values()) >= self.max_waiting:
+                self.metrics.increment("scheduler_shed_total", model=model, reason="queue_full")
+                raise OverloadedError(OVERLOAD_MESSAGE)
+            event = threading.Event()
+            sessions.setdefault(session, deque()).append(event)
+        if not event.wait(self.max_wait):
+            with self._lock:
+                # Место могло освободиться между таймаутом и захватом блокировки
+                if not event.is_set():
+                    events = sessions.get(session)
+                    if events is not None:
+                        events.remove(event)
+                        if not events:
+                            del sessions[session]
+                    self.metrics.increment("scheduler_shed_total", model=model, reason="timeout")
+                    raise OverloadedError(OVERLOAD_MESSAGE)
+        self.metrics.observe("scheduler_wait_seconds", time.monotonic() - start_time, model=model)
+
+    def release(self, model: str):
+        with self._lock:
+            sessions = self._queues.get(model)
+            if not sessions:
+                self._running[model] -= 1
+                return
+            # Место переходит следующей сессии по кругу, счётчик не меняется
+            session, events = next(iter(sessions.items()))
+            event = events.popleft()
+            if events:
+                sessions.move_to_end(session)
+            else:
+                del sessions[session]
+            event.set()
+
+    def position(self, session: str):
+        # Место сессии в очереди по кругу (1 — следующая), None — сессия ничего не ждёт
+        with self._lock:
+            positions = [list(sessions).index(session) + 1
+                         for sessions in self._queues.values() if session in sessions]
+        return min(positions) if positions else None
+
+    def stats(self) -> list:
+        with self._lock:
+            models = sorted(set(self._running) | set(self._queues))
+            return [{"model": model, "running": self._running.get(model, 0),
+                     "cap": self.caps.get(model, self.default_cap),
+                     "waiting": sum(len(events) for events in self._queues.get(model, {}).values()),
+                     "sessions": len(self._queues.get(model, {}))}
+                    for model in models]
+
+
+class FairExecutor:
+    # Общий пул потоков, но задачи ждут не в его FIFO-очереди, а в очередях по
+    # сессиям: освободившийся поток берёт задачу следующей сессии по кругу
+    def __init__(self, executor, max_workers: int):
+        self.executor = executor
+        self.max_workers = max_workers
+        self._running = 0
+        self._queues = OrderedDict()  # session -> deque[(Future, fn, args, kwargs)]
+        self._lock = threading.Lock()
+
+    def for_session(self, session: str) -> "SessionExecutor":
+        return SessionExecutor(self, session)
+
+    def submit(self, session: str, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self._lock:
+            self._queues.setdefault(session, deque()).append((future, fn, args, kwargs))
+        self._dispatch()
+        return future
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(tasks) for tasks in self._queues.values())
+
+    def _dispatch(self):
+        tasks = []
+        with self._lock:
+            while self._queues and self._running < self.max_workers:
+                session, queue = next(iter(self._queues.items()))
+                tasks.append(queue.popleft())
+                if queue:
+                    self._queues.move_to_end(session)
+                else:
+                    del self._queues[session]
+                self._running += 1
+        for task in tasks:
+            self.executor.submit(self._run, *task)
+
+    def _run(self, future: Future, fn, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._dispatch()
+
+
+class SessionExecutor:
+    # executor.submit(...) от имени одной сессии — то, что ждут pipeline и analysis
+    def __init__(self, pool: FairExecutor, session: str):
+        self.pool = pool
+        self.session = session
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        return self.pool.submit(self.session, fn, *args, **kwargs)
+
+
+class _ScheduledStream:
+    # Потоковый ответ держит место у модели, пока его не дочитают, не закроют
+    # или не соберут: брошенный на полпути поток не занимает место навсегда
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class ScheduledClient:
+    # Тот же интерфейс client.chat.completions.create(...): каждый вызов (вместе
+    # с повторами ResilientClient) занимает место у модели от имени сессии.
+    # Потоковый ответ держит место, пока его не дочитают или не закроют
+    def __init__(self, client, scheduler: FairScheduler, session: str):
+        self.client = client
+        self.scheduler = scheduler
+        self.session = session
+        self.chat = _Chat(self)
+
+    def create(self, **kwargs):
+        model = kwargs.get("model")
+        self.scheduler.acquire(model, self.session)
+        try:
+            response = self.client.chat.completions.create(**kwargs)
+        except BaseException:
+            self.scheduler.release(model)
+            raise
+        if kwargs.get("stream"):
+            return _ScheduledStream(response, lambda: self.scheduler.release(model))
+        self.scheduler.release(model)
+        return response
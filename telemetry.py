@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from result_cache import CACHE_DIR
+
+
+# --- Метрики процесса: этапы, вызовы модели, токены, стоимость, кэш ---
+# Один реестр на процесс (общий для всех сессий Streamlit). Снимок в формате
+# Prometheus пишется в текстовый файл (для node_exporter textfile collector
+# или просто cat), каждый вызов модели можно дописывать строкой в JSON-лог.
+#
+#   PROJECT_CHECKER_METRICS_FILE=.cache/metrics.prom
+#   PROJECT_CHECKER_METRICS_LOG=.cache/llm_calls.jsonl   (по умолчанию выключен)
+
+METRICS_FILE = os.environ.get("PROJECT_CHECKER_METRICS_FILE", os.path.join(CACHE_DIR, "metrics.prom"))
+METRICS_LOG = os.environ.get("PROJECT_CHECKER_METRICS_LOG")
+WINDOW_SIZE = 500  # Сколько последних наблюдений держим для p50/p95
+FLUSH_INTERVAL_SECONDS = 10.0
+
+# USD за 1M токенов (запрос, ответ) — сверяйте с актуальным прайсом провайдера
+MODEL_PRICES = {
+    "deepseek-ai/DeepSeek-R1": (0.80, 2.40),
+    "deepseek-ai/DeepSeek-V3": (0.50, 1.50),
+    "google/gemma-3-27b-it": (0.10, 0.30),
+}
+
+
+def _percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _labels_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    def __init__(self, path: str = METRICS_FILE, log_path: str = METRICS_LOG):
+        self.path = path
+        self.log_path = log_path
+        self._counters = {}
+        self._windows = {}
+        self._sums = {}
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._windows.setdefault(key, deque(maxlen=WINDOW_SIZE)).append(seconds)
+            total, count = self._sums.get(key, (0.0, 0))
+            self._sums[key] = (total + seconds, count + 1)
+
+    def record_llm_call(self, model: str, seconds: float, usage=None, status: str = "ok",
+                        stream: bool = False, first_token: float = None):
+        self.increment("llm_requests_total", model=model, status=status)
+        if status == "ok":
+            self.observe("llm_request_seconds", seconds, model=model)
+        if first_token is not None:
+            self.observe("llm_first_token_seconds", first_token, model=model)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        if prompt_tokens or completion_tokens:
+            self.increment("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+            self.increment("llm_tokens_total", completion_tokens, model=model, kind="completion")
+            prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+            cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+            self.increment("llm_cost_usd_total", cost, model=model)
+        if self.log_path:
+            self._log({"ts": time.time(), "model": model, "status": status, "seconds": round(seconds, 3),
+                       "first_token": first_token, "stream": stream,
+                       "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+
+    def record_pipeline(self, timings: dict, from_cache: bool, cached_captions: int, captions: int):
+        for stage, seconds in timings.items():
+            self.observe("stage_seconds", seconds, stage=stage)
+        self.increment("cache_lookups_total", kind="analysis", result="hit" if from_cache else "miss")
+        if captions:
+            self.increment("cache_lookups_total", cached_captions, kind="caption", result="hit")
+            self.increment("cache_lookups_total", captions - cached_captions, kind="caption", result="miss")
+        self.flush()
+
+    def snapshot(self) -> list:
+        # Строки для панели: метрика, метки, p50, p95, число наблюдений
+        with self._lock:
+            windows = {key: sorted(values) for key, values in self._windows.items()}
+        rows = []
+        for (name, labels), ordered in sorted(windows.items()):
+            rows.append({"metric": name, "labels": dict(labels), "p50": _percentile(ordered, 0.5),
+                         "p95": _percentile(ordered, 0.95), "count": len(ordered)})
+        return rows
+
+    def counters(self) -> list:
+        with self._lock:
+            items = sorted(self._counters.items())
+        return [{"metric": name, "labels": dict(labels), "value": value} for (name, labels), value in items]
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            windows = {key: sorted(values) for key, values in self._windows.items()}
+            sums = dict(self._sums)
+        lines = []
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{_labels_text(labels)} {value:g}"
+                         for (metric, labels), value in counters if metric == name)
+        for name in sorted({name for name, _ in windows}):
+            lines.append(f"# TYPE {name} summary")
+            for (metric, labels), ordered in sorted(windows.items()):
+                if metric != name:
+                    continue
+                for q in (0.5, 0.95):
+                    quantile = labels + (("quantile", str(q)),)
+                    lines.append(f"{name}{_labels_text(quantile)} {_percentile(ordered, q):.6f}")
+                total, count = sums[(metric, labels)]
+                lines.append(f"{name}_sum{_labels_text(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self, force: bool = False):
+        # Не чаще раза в FLUSH_INTERVAL_SECONDS; запись атомарная через временный файл
+        now = time.monotonic()
+        if not self.path or (not force and now - self._flushed < FLUSH_INTERVAL_SECONDS):
+            return
+        self._flushed = now
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # Метрики не должны ронять анализ
+
+    def _log(self, event: dict):
+        try:
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+
+METRICS = Metrics()
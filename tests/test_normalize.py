@@ -0,0 +1,55 @@
+from dataclasses import dataclass, field
+
+from normalize import line_key, normalize_document
+
+
+@dataclass
+class Page:
+    text: str
+    edge_lines: list = field(default_factory=list)
+
+
+@dataclass
+class Document:
+    pages: list
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(page.text for page in self.pages)
+
+
+def test_numeric_value_lines_are_kept():
+    values = ["72%", "15%", "3%", "260 раз", "100%"]
+    doc = Document([Page(f"Показатель {word}\n{value}", edge_lines=[value])
+                    for word, value in zip(["альфа", "бета", "гамма", "дельта", "эпсилон"], values)])
+    normalize_document(doc)
+    assert [page.text.splitlines()[-1] for page in doc.pages] == values
+
+
+def test_repeated_value_line_is_kept_anywhere():
+    doc = Document([Page(f"Слайд про {word}\nв 260 раз") for word in ["альфа", "бета", "гамма", "дельта"]])
+    normalize_document(doc)
+    assert all(page.text.endswith("в 260 раз") for page in doc.pages)
+
+
+def test_footer_and_page_numbers_are_removed():
+    words = ["альфа", "бета", "гамма", "дельта", "эпсилон"]
+    doc = Document([Page(f"МГТУ им. Баумана 2024\nРаздел {word}: про техноло-\nгию добычи\n{number} / 5",
+                         edge_lines=["МГТУ им. Баумана 2024", f"{number} / 5"])
+                    for number, word in enumerate(words, start=1)])
+    saved = normalize_document(doc)
+    assert doc.pages[2].text == "Раздел гамма: про технологию добычи"
+    assert saved > 0
+
+
+def test_page_number_kept_away_from_edge():
+    doc = Document([Page(f"Текст {word}\n{number} / 5", edge_lines=[] if number == 2 else [f"{number} / 5"])
+                    for number, word in enumerate(["альфа", "бета", "гамма", "дельта", "эпсилон"], start=1)])
+    normalize_document(doc)
+    assert doc.pages[1].text.endswith("2 / 5")
+    assert doc.pages[0].text == "Текст альфа"
+
+
+def test_line_key_masks_digits_only_on_request():
+    assert line_key("Стр.  3") == "стр. 3"
+    assert line_key("Стр.  3", mask_digits=True) == "стр. #"
@@ -0,0 +1,99 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+
+
+# --- Загруженный файл во временном файле вместо копий в памяти ---
+# Загрузка один раз переписывается блоками во временный файл, дальше парсеры
+# открывают его по пути (fitz.open(path), Presentation(path)), а кому нужны
+# байты — получают отображение в память без копии. Файл удаляется в close(),
+# то есть в конце задачи анализа; забытые файлы подчищаются при следующих загрузках.
+
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024  # Как server.maxUploadSize у Streamlit по умолчанию
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "project-checker-uploads")
+STALE_SPOOL_SECONDS = 24 * 3600
+COPY_BLOCK_BYTES = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    pass
+
+
+class SpooledUpload:
+    def __init__(self, path: str, name: str, size: int):
+        self.path = path
+        self.name = name  # Исходное имя файла: по расширению выбирается парсер
+        self.size = size
+
+    def mmap(self) -> mmap.mmap:
+        # Только для чтения; закрывать вызывающему (поддерживает with)
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def content_hash(self) -> str:
+        # SHA-256 по отображению файла в память: без чтения копии в кучу
+        if not self.size:
+            return hashlib.sha256(b"").hexdigest()
+        with self.mmap() as view:
+            return hashlib.sha256(view).hexdigest()
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def spool_upload(uploaded_file, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    size = getattr(uploaded_file, "size", None)
+    if size is not None and size > max_bytes:
+        raise UploadTooLargeError(_too_large_message(max_bytes))
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    _remove_stale()
+    suffix = os.path.splitext(uploaded_file.name)[1].lower()
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=SPOOL_DIR, suffix=suffix, delete=False) as out:
+        written = 0
+        try:
+            for block in iter(lambda: uploaded_file.read(COPY_BLOCK_BYTES), b""):
+                written += len(block)
+                if written > max_bytes:
+                    raise UploadTooLargeError(_too_large_message(max_bytes))
+                out.write(block)
+        except Exception:
+            out.close()
+            os.remove(out.name)
+            raise
+    return SpooledUpload(out.name, os.path.basename(uploaded_file.name), written)
+
+
+def _too_large_message(max_bytes: int) -> str:
+    return f"Файл больше {max_bytes // (1024 * 1024)} МБ — сократите презентацию или сожмите изображения"
+
+
+def _remove_stale():
+    # Файлы задач, которые так и не завершились (например, перезапуск сервера)
+    now = time.time()
+    for entry in os.scandir(SPOOL_DIR):
+        try:
+            if now - entry.stat().st_mtime > STALE_SPOOL_SECONDS:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def content_hash(uploaded_file) -> str:
+    # SpooledUpload или объект с getbuffer()/getvalue() (BytesIO, UploadedFile)
+    if isinstance(uploaded_file, SpooledUpload):
+        return uploaded_file.content_hash()
+    if hasattr(uploaded_file, "getbuffer"):
+        return hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
@@ -0,0 +1,43 @@
+import base64
+import io
+
+from PIL import Image
+
+
+# --- Подготовка изображений для мультимодальной модели ---
+# Перед отправкой картинка уменьшается и пережимается: модели хватает
+# 768px по длинной стороне, а запрос становится в разы легче.
+
+VISION_MAX_SIDE = 768
+VISION_QUALITY = 70
+VISION_FORMAT = "JPEG"  # или "WEBP"
+VISION_BATCH_SIZE = 3  # Сколько изображений отправлять в одном запросе
+
+
+def downscale_image(img_data: bytes, max_side: int = VISION_MAX_SIDE,
+                    quality: int = VISION_QUALITY, fmt: str = VISION_FORMAT) -> bytes:
+    with Image.open(io.BytesIO(img_data)) as img:
+        img.thumbnail((max_side, max_side))
+        if img.mode not in ("RGB", "L"):
+            # У JPEG нет альфа-канала: подкладываем белый фон
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            img = background
+        buffer = io.BytesIO()
+        img.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def to_data_url(img_data: bytes, fmt: str = VISION_FORMAT) -> str:
+    b64 = base64.b64encode(img_data).decode("utf-8")
+    return f"data:image/{fmt.lower()};base64,{b64}"
+
+
+def image_content_part(img_data: bytes, **kwargs) -> dict:
+    fmt = kwargs.get("fmt", VISION_FORMAT)
+    return {"type": "image_url", "image_url": {"url": to_data_url(downscale_image(img_data, **kwargs), fmt)}}
+
+
+def batched(items: list, size: int = VISION_BATCH_SIZE) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]